@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import os
 import re
 import time
 from pathlib import Path
@@ -14,12 +15,13 @@ from app.api.auth_middleware import (
     add_httpx_timing_hooks,
     make_session_robust,
     normalize_auth_exception_response,
+    warm_up_session,
 )
 from app.api.market_data_api import register_market_data_api
 from app.api.stock_analysis_api import register_investment_opportunities_api, register_stock_analysis_api
 from app.api.trading_api import trading_bp
-from app.db.database import StockDatabase
-from app.utils.date_utils import TradingDateUtils
+from app.db.database import db
+from app.utils.date_utils import trading_date_utils
 
 logging.basicConfig(
     level=logging.INFO,
@@ -32,18 +34,29 @@ logging.getLogger('httpcore').setLevel(logging.WARNING)
 logger = logging.getLogger('api')
 frontend_dist = Path(__file__).resolve().parents[3] / 'frontend' / 'out'
 PAGE_ROUTE_SUFFIX_RE = re.compile(r'(/index\.(?:txt|html)|\.(?:txt|html))/?$', re.IGNORECASE)
+# 生产环境页面与 API 同域，跨域只需放行开发环境的前端地址；可通过逗号分隔的 CORS_ORIGINS 覆盖
+DEFAULT_CORS_ORIGINS = 'http://localhost:3000,http://127.0.0.1:3000'
+CORS_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv('CORS_ORIGINS', DEFAULT_CORS_ORIGINS).split(',')
+    if origin.strip()
+]
+# 浏览器缓存预检（OPTIONS）结果的秒数
+CORS_MAX_AGE_SECONDS = 86400
 
 app = Flask(__name__)
 app.config['JSON_AS_ASCII'] = False
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 # 反向代理（nginx）终止 TLS 时，让重定向与绝对 URL 使用正确的 https scheme
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
-CORS(app)
+# 仅 /api/* 需要跨域，静态页面不经过 CORS 处理
+CORS(app, resources={r'/api/*': {'origins': CORS_ORIGINS}}, max_age=CORS_MAX_AGE_SECONDS)
 
-db = StockDatabase()
+# 复用 database / date_utils 模块级单例，每个 worker 进程只保留一个 Supabase 连接池和一份交易日历缓存。
+# gunicorn 未使用 --preload，模块在各 worker 内导入，连接均在 fork 之后建立。
 make_session_robust(db.client)
 add_httpx_timing_hooks(db.client)
-trading_date_utils = TradingDateUtils()
+warm_up_session(db.client)
 
 
 def _canonicalize_page_route(request_path: str) -> str | None:
@@ -69,13 +82,16 @@ def _canonicalize_page_route(request_path: str) -> str | None:
 
 @app.before_request
 def _start_timer():
-    g.start_time = time.time()
+    g.start_time = time.perf_counter()
 
 
 @app.after_request
 def _log_request(response):
-    elapsed = time.time() - g.start_time
-    logger.info(f"{request.method} {request.full_path.rstrip('?')} -> {response.status_code} ({elapsed:.3f}s)")
+    # 日志级别未开启 INFO 时跳过路径拼接与格式化
+    if logger.isEnabledFor(logging.INFO):
+        elapsed = time.perf_counter() - g.start_time
+        logger.info('%s %s -> %d (%.3fs)', request.method, request.full_path.rstrip('?'),
+                    response.status_code, elapsed)
     return response
 
 
@@ -321,6 +321,9 @@ import threading
 from postgrest import SyncPostgrestClient
 from postgrest.utils import SyncClient
 
+# Supabase 连接池：保持长连接，避免请求间隔稍长就重新握手
+SUPABASE_POOL_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=300)
+
 
 class _RetryTransport(httpx.HTTPTransport):
     """自动重试 HTTP/2 瞬时协议错误（如 Server disconnected / GOAWAY）。
@@ -343,7 +346,7 @@ class _RobustPostgrestClient(SyncPostgrestClient):
     """带连接重试能力的 PostgREST 客户端。"""
 
     def create_session(self, base_url, headers, timeout, verify=True, proxy=None):
-        transport = _RetryTransport(http2=True, verify=verify)
+        transport = _RetryTransport(http2=True, verify=verify, limits=SUPABASE_POOL_LIMITS)
         return SyncClient(
             base_url=base_url,
             headers=headers,
@@ -361,13 +364,25 @@ def make_session_robust(supabase_client):
     try:
         session = supabase_client.postgrest.session
         old_transport = session._transport
-        session._transport = _RetryTransport(http2=True)
+        session._transport = _RetryTransport(http2=True, limits=SUPABASE_POOL_LIMITS)
         old_transport.close()
         logger.info("Supabase client transport upgraded with retry support")
     except Exception as e:
         logger.warning(f"Failed to configure robust session: {e}")
 
 
+def warm_up_session(supabase_client, table: str = 'stock_records'):
+    """在后台线程发起一次轻量请求，提前完成 TLS 与 HTTP/2 握手，避免首个用户请求承担建连耗时。"""
+    def _warm_up():
+        try:
+            supabase_client.postgrest.session.head(f"/{table}", params={'select': 'id', 'limit': '1'})
+            logger.info("Supabase connection pool warmed up")
+        except Exception as e:
+            logger.warning(f"Failed to warm up Supabase connection: {e}")
+
+    threading.Thread(target=_warm_up, name='supabase-warm-up', daemon=True).start()
+
+
 # ============================================
 # 请求级别隔离的用户 PostgREST 客户端
 # ============================================
@@ -4,34 +4,75 @@
 包含交易日、富途统计与市场宽度接口
 """
 
-import math
 import os
 from datetime import datetime, timedelta
 
+import numpy as np
+import pandas as pd
 from flask import Blueprint, jsonify, request
 
 from app.api.auth_middleware import optional_token_reauth_on_error, raise_if_auth_exception
 from app.utils.futu_data import (
     build_leader_stock_metrics,
+    convert_to_futu_codes,
     get_market_leader_insights,
     get_market_leader_list,
     get_market_snapshots_by_futu_codes,
 )
+from app.utils.market_breadth import INDEX_LABELS
+from app.utils.sector_classifier import INDEX_CODES, SECTOR_INDUSTRY_MAP
+from app.utils.ttl_cache import (
+    AVAILABLE_DATES_TTL_SECONDS,
+    MARKET_BREADTH_TTL_SECONDS,
+    STOCK_QUOTE_TTL_SECONDS,
+    available_dates_cache,
+    market_breadth_cache,
+    stock_quote_cache,
+)
 
 market_data_bp = Blueprint('market_data', __name__)
 
 _db = None
 _trading_date_utils = None
 
+# 市场宽度查询参数的合法取值；只有合法参数组合才写入缓存，避免任意参数让缓存无限增长
+_BREADTH_TYPES = frozenset({'index', 'sector', 'industry'})
+_BREADTH_SECTORS = frozenset(
+    [*INDEX_LABELS.values(), *INDEX_CODES, *SECTOR_INDUSTRY_MAP.keys()]
+    + [industry for industries in SECTOR_INDUSTRY_MAP.values() for industry in industries]
+)
 
-def _safe_float(value, default=0.0):
-    try:
-        number = float(value)
-        if math.isnan(number):
-            return default
-        return number
-    except Exception:
-        return default
+# 行业成分股接口用到的快照字段，只缓存这些列
+_INDUSTRY_QUOTE_COLUMNS = (
+    'code', 'name', 'last_price', 'prev_close_price', 'volume', 'turnover',
+    'pe_ratio', 'volume_ratio', 'turnover_rate',
+)
+
+
+def _get_industry_quotes(futu_codes):
+    """
+    获取行业成分股快照：命中短期缓存的代码直接复用，只向富途请求缓存过期的代码
+    :param futu_codes: 富途代码列表，如 ['SH.600519']
+    :return: 快照 DataFrame
+    """
+    rows = []
+    stale_codes = []
+    for futu_code in dict.fromkeys(futu_codes):
+        row = stock_quote_cache.get(futu_code)
+        if row is None:
+            stale_codes.append(futu_code)
+        else:
+            rows.append(row)
+
+    if stale_codes:
+        fresh_df = get_market_snapshots_by_futu_codes(stale_codes, batch_size=400)
+        if not fresh_df.empty:
+            columns = [column for column in _INDUSTRY_QUOTE_COLUMNS if column in fresh_df.columns]
+            for row in fresh_df[columns].to_dict('records'):
+                stock_quote_cache.set(str(row['code']).strip(), row, STOCK_QUOTE_TTL_SECONDS)
+                rows.append(row)
+
+    return pd.DataFrame(rows)
 
 
 def _truncate_briefing_preview(content: str, max_len: int = 120) -> str:
@@ -62,11 +103,16 @@ def get_available_dates():
         end_date = (now - timedelta(days=1)).strftime('%Y-%m-%d') if before_open else now.strftime('%Y-%m-%d')
         start_date = (now - timedelta(days=60)).strftime('%Y-%m-%d')
 
-        cn_days = set(_trading_date_utils.get_trading_days_in_range(start_date, end_date, market="CN"))
-        hk_days = set(_trading_date_utils.get_trading_days_in_range(start_date, end_date, market="HK"))
-        all_days = sorted(cn_days | hk_days, reverse=True)[:30]
+        # 结果只取决于日期区间，按区间缓存，避免每次请求都重新计算交易日历
+        cache_key = f"{start_date}|{end_date}"
+        all_days = available_dates_cache.get(cache_key)
+        if all_days is None:
+            all_days = _trading_date_utils.get_trading_days_union(start_date, end_date, markets=("CN", "HK"))[-30:][::-1]
+            available_dates_cache.set(cache_key, all_days, AVAILABLE_DATES_TTL_SECONDS)
 
-        return jsonify({'success': True, 'data': all_days})
+        response = jsonify({'success': True, 'data': all_days})
+        response.headers['Cache-Control'] = f'public, max-age={AVAILABLE_DATES_TTL_SECONDS}'
+        return response
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -132,9 +178,18 @@ def get_market_breadth():
     try:
         limit = int(request.args.get('limit', 10))
         limit = max(1, min(limit, 30))
-        breadth_type = request.args.get('breadth_type')
+        breadth_type = request.args.get('breadth_type') or None
         sector = request.args.get('sector', '').strip() or None
-        data = _db.get_market_breadth_records(limit=limit, breadth_type=breadth_type, sector=sector)
+        cacheable = (
+            (breadth_type is None or breadth_type in _BREADTH_TYPES)
+            and (sector is None or sector in _BREADTH_SECTORS)
+        )
+        cache_key = f"{limit}|{breadth_type}|{sector}"
+        data = market_breadth_cache.get(cache_key) if cacheable else None
+        if data is None:
+            data = _db.get_market_breadth_records(limit=limit, breadth_type=breadth_type, sector=sector)
+            if cacheable:
+                market_breadth_cache.set(cache_key, data, MARKET_BREADTH_TTL_SECONDS)
         return jsonify({
             'success': True,
             'data': data,
@@ -165,17 +220,24 @@ def get_industry_stocks():
                 }
             })
 
-        futu_codes = []
-        stock_meta = {}
-        for item in stocks:
-            exchange = str(item.get('exchange', '')).strip()
-            stock_code = str(item.get('stock_code', '')).strip()
-            stock_name = str(item.get('stock_name', '')).strip()
-            if not exchange or not stock_code or stock_name.endswith("退"):
-                continue
-            futu_code = f"{exchange}.{stock_code}"
-            futu_codes.append(futu_code)
-            stock_meta[futu_code] = item
+        # 按列整体拼接富途代码并过滤无效/退市股票，避免逐行构造字符串
+        meta_df = pd.DataFrame.from_records(stocks, columns=['exchange', 'stock_code', 'stock_name'])
+        meta_df = meta_df[meta_df['exchange'].notna() & meta_df['stock_code'].notna()]
+        exchanges = meta_df['exchange'].astype(str).str.strip()
+        stock_names = meta_df['stock_name'].where(meta_df['stock_name'].notna(), '')
+        valid = (
+            (exchanges != '')
+            & (meta_df['stock_code'].astype(str).str.strip() != '')
+            & ~stock_names.astype(str).str.strip().str.endswith('退')
+        )
+        meta_df = meta_df[valid]
+        exchanges = exchanges[valid]
+        futu_codes = convert_to_futu_codes(meta_df['stock_code'].astype(str).str.strip(), exchanges=exchanges).tolist()
+        # 同一代码重复出现时以最后一条为准
+        stock_meta = dict(zip(
+            futu_codes,
+            zip(meta_df['stock_code'].astype(str).tolist(), exchanges.tolist(), stock_names[valid].tolist()),
+        ))
 
         if not futu_codes:
             return jsonify({
@@ -188,7 +250,7 @@ def get_industry_stocks():
                 }
             })
 
-        quote_df = get_market_snapshots_by_futu_codes(futu_codes, batch_size=400)
+        quote_df = _get_industry_quotes(futu_codes)
         if quote_df.empty:
             return jsonify({
                 'success': True,
@@ -200,41 +262,54 @@ def get_industry_stocks():
                 }
             })
 
-        snapshot_by_code = {}
-        for _, row in quote_df.iterrows():
-            code = str(row.get('code', '')).strip()
-            if code:
-                snapshot_by_code[code] = row
-
-        result_stocks = []
-        for futu_code in futu_codes:
-            row = snapshot_by_code.get(futu_code)
-            if row is None:
-                continue
-
-            meta = stock_meta.get(futu_code, {})
-            exchange = str(meta.get('exchange', '')).strip()
-            if not exchange and '.' in futu_code:
-                exchange = futu_code.split('.', 1)[0].strip()
+        # 按列整体转换数值并计算涨跌幅，再按 futu_codes 顺序定位行，避免逐行构造 Series
+        quote_df = quote_df.assign(
+            code=quote_df['code'].astype(str).str.strip()
+        ).drop_duplicates('code', keep='last')
+        positions = pd.Index(quote_df['code']).get_indexer(futu_codes).tolist()
+
+        def numeric_column(column):
+            if column not in quote_df.columns:
+                return np.zeros(len(quote_df))
+            return pd.to_numeric(quote_df[column], errors='coerce').fillna(0.0).to_numpy(dtype=float)
+
+        last_price = numeric_column('last_price')
+        prev_close = numeric_column('prev_close_price')
+        # 昨收为 0 的行不做除法，涨跌幅保持 0
+        change_ratio = np.divide(
+            last_price - prev_close, prev_close, out=np.zeros_like(prev_close), where=prev_close > 0
+        )
+        change_ratio = np.round(change_ratio * 100, 2).tolist()
+        volume = numeric_column('volume').tolist()
+        amount_values = numeric_column('turnover')
+        amount = amount_values.tolist()
+        pe_ratio = numeric_column('pe_ratio').tolist()
+        volume_ratio = numeric_column('volume_ratio').tolist()
+        turnover_rate = numeric_column('turnover_rate').tolist()
+        quote_names = (
+            quote_df['name'].tolist() if 'name' in quote_df.columns else [''] * len(quote_df)
+        )
 
-            last_price = _safe_float(row.get('last_price'), 0.0)
-            prev_close = _safe_float(row.get('prev_close_price'), 0.0)
-            change_ratio = (last_price - prev_close) / prev_close * 100 if prev_close > 0 else 0.0
+        # 按成交额降序输出；稳定排序使成交额相同的股票保持原有顺序
+        matched = [(futu_code, pos) for futu_code, pos in zip(futu_codes, positions) if pos >= 0]
+        matched_amounts = amount_values[[pos for _, pos in matched]]
+        order = np.argsort(-matched_amounts, kind='stable').tolist()
 
+        result_stocks = []
+        for futu_code, pos in (matched[i] for i in order):
+            stock_code, exchange, stock_name = stock_meta[futu_code]
             result_stocks.append({
-                'code': str(meta.get('stock_code', '')),
+                'code': stock_code,
                 'exchange': exchange,
-                'name': str(meta.get('stock_name', '') or row.get('name', '')),
-                'changeRatio': round(change_ratio, 2),
-                'volume': _safe_float(row.get('volume'), 0.0),
-                'amount': _safe_float(row.get('turnover'), 0.0),
-                'pe': _safe_float(row.get('pe_ratio'), 0.0),
-                'volumeRatio': _safe_float(row.get('volume_ratio'), 0.0),
-                'turnoverRate': _safe_float(row.get('turnover_rate'), 0.0),
+                'name': str(stock_name or quote_names[pos]),
+                'changeRatio': change_ratio[pos],
+                'volume': volume[pos],
+                'amount': amount[pos],
+                'pe': pe_ratio[pos],
+                'volumeRatio': volume_ratio[pos],
+                'turnoverRate': turnover_rate[pos],
             })
 
-        result_stocks.sort(key=lambda item: item.get('amount', 0), reverse=True)
-
         return jsonify({
             'success': True,
             'data': {
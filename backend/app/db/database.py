@@ -2,8 +2,9 @@
 
 import math
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional
 from supabase import create_client, Client
 from dotenv import load_dotenv
 from app.utils.date_utils import TradingDateUtils
@@ -11,9 +12,15 @@ from app.utils.date_utils import TradingDateUtils
 # 加载环境变量
 load_dotenv()
 
+# 批量更新 RPC 的并发批次数
+_RPC_BATCH_WORKERS = 4
+
 
 def _safe_float(value, default: float = 0.0) -> float:
     """将数值转为 float，NaN/Inf 等非有限值替换为 default（JSON 不可序列化）。"""
+    # Supabase 返回的数值列绝大多数已是 float，直接判断有限性，跳过 float() 转换与异常处理
+    if type(value) is float:
+        return value if math.isfinite(value) else default
     if value is None:
         return default
     try:
@@ -61,8 +68,9 @@ class StockDatabase:
         :param market: 市场 ('A' 或 'HK')
         :param data: 股票数据字典
         """
-        current_date = datetime.now().strftime('%Y-%m-%d')
-        current_time = datetime.now().strftime('%H:%M:%S')
+        now = datetime.now()
+        current_date = now.strftime('%Y-%m-%d')
+        current_time = now.strftime('%H:%M:%S')
         
         try:
             # 先删除当日同数据源同市场的所有数据，确保数据一致性
@@ -173,6 +181,21 @@ class StockDatabase:
             response = self.client.table('stock_records').select('date').order('date', desc=True).execute()
             return list(dict.fromkeys([row['date'] for row in response.data]))[:limit]
     
+    def get_distinct_date_count(self) -> int:
+        """
+        统计 stock_records 中不重复的日期数量（使用 RPC 在数据库端计数）
+        :return: 日期数量
+        """
+        try:
+            response = self.client.rpc('count_distinct_dates', {}).execute()
+            return int(response.data or 0)
+
+        except Exception as e:
+            print(f"❌ 统计日期数量失败: {e}")
+            # 如果 RPC 函数不存在，退回到拉取日期列表计数
+            print("⚠️  使用备用查询方法")
+            return len(self.get_available_dates(limit=1000))
+
     def get_stock_history(self, stock_code: str, days: int = 7) -> List[Dict]:
         """
         获取特定股票的历史统计记录
@@ -334,39 +357,56 @@ class StockDatabase:
             print(f"❌ 查询股票基础信息失败: {e}")
             raise
 
-    def get_stock_basic_info_paginated(
+    def iter_stock_basic_info(
         self,
         market: Optional[str] = None,
         page_size: int = 1000,
-        columns: str = '*'
-    ) -> List[Dict]:
+        columns: str = '*',
+        or_filter: Optional[str] = None
+    ) -> Iterator[Dict]:
         """
-        分页获取股票基础信息（避免 Supabase 单次查询限制）
+        逐页迭代股票基础信息，调用方按需过滤，内存中只保留当前页
         :param market: 市场筛选，可选 'A' 或 'HK'
         :param page_size: 每页数量
         :param columns: 查询字段
-        :return: 股票基础信息列表
+        :param or_filter: 可选的 PostgREST or 过滤条件，在服务端预先筛选
+        :return: 股票基础信息迭代器
         """
         try:
-            results: List[Dict] = []
             offset = 0
             while True:
                 query = self.client.table('stock_basic_info').select(columns)
                 if market:
                     query = query.eq('market', market)
+                if or_filter:
+                    query = query.or_(or_filter)
                 response = query.range(offset, offset + page_size - 1).execute()
                 batch = response.data or []
                 if not batch:
                     break
-                results.extend(batch)
+                yield from batch
                 if len(batch) < page_size:
                     break
                 offset += page_size
-            return results
         except Exception as e:
             print(f"❌ 分页查询股票基础信息失败: {e}")
             raise
 
+    def get_stock_basic_info_paginated(
+        self,
+        market: Optional[str] = None,
+        page_size: int = 1000,
+        columns: str = '*'
+    ) -> List[Dict]:
+        """
+        分页获取股票基础信息（避免 Supabase 单次查询限制）
+        :param market: 市场筛选，可选 'A' 或 'HK'
+        :param page_size: 每页数量
+        :param columns: 查询字段
+        :return: 股票基础信息列表
+        """
+        return list(self.iter_stock_basic_info(market=market, page_size=page_size, columns=columns))
+
     def get_stock_basic_info_by_codes(
         self,
         codes: List[str],
@@ -426,6 +466,29 @@ class StockDatabase:
             print(f"❌ 按行业查询股票基础信息失败: {e}")
             raise
 
+    def _rpc_in_batches(self, rpc_name: str, records: List[Dict], batch_size: int, label: str):
+        """
+        按批次调用批量更新 RPC；各批记录按主键 id 独立更新、互不依赖，故并发提交
+        :param rpc_name: RPC 函数名
+        :param records: 待更新记录
+        :param batch_size: 每批次记录数量
+        :param label: 进度日志前缀
+        """
+        total = len(records)
+        starts = range(0, total, batch_size)
+
+        def run_batch(start: int):
+            end = min(start + batch_size, total)
+            response = self.client.rpc(rpc_name, {'p_records': records[start:end]}).execute()
+            updated = response.data or 0
+            print(
+                f"✅ {label}: {end}/{total} "
+                f"(batch {start // batch_size + 1}, updated {updated})"
+            )
+
+        with ThreadPoolExecutor(max_workers=min(_RPC_BATCH_WORKERS, len(starts))) as executor:
+            list(executor.map(run_batch, starts))
+
     def upsert_stock_basic_metadata(self, records: List[Dict], batch_size: int = 500):
         """
         按主键批量更新股票行业分类等扩展字段（仅更新，不插入）
@@ -435,19 +498,9 @@ class StockDatabase:
         try:
             if not records:
                 return
-            total = len(records)
-            for start in range(0, total, batch_size):
-                end = min(start + batch_size, total)
-                batch = records[start:end]
-                response = self.client.rpc(
-                    'update_stock_basic_metadata_batch',
-                    {'p_records': batch}
-                ).execute()
-                updated = response.data or 0
-                print(
-                    f"✅ 已更新股票扩展信息: {end}/{total} "
-                    f"(batch {start // batch_size + 1}, updated {updated})"
-                )
+            self._rpc_in_batches(
+                'update_stock_basic_metadata_batch', records, batch_size, "已更新股票扩展信息"
+            )
         except Exception as e:
             print(f"❌ 更新股票扩展信息失败: {e}")
             raise
@@ -493,19 +546,9 @@ class StockDatabase:
         try:
             if not records:
                 return
-            total = len(records)
-            for start in range(0, total, batch_size):
-                end = min(start + batch_size, total)
-                batch = records[start:end]
-                response = self.client.rpc(
-                    'update_stock_basic_index_membership_batch',
-                    {'p_records': batch}
-                ).execute()
-                updated = response.data or 0
-                print(
-                    f"✅ 已批量更新指数归属: {end}/{total} "
-                    f"(batch {start // batch_size + 1}, updated {updated})"
-                )
+            self._rpc_in_batches(
+                'update_stock_basic_index_membership_batch', records, batch_size, "已批量更新指数归属"
+            )
         except Exception as e:
             print(f"❌ 批量更新指数归属失败: {e}")
             raise
@@ -3,10 +3,44 @@
 提供交易日判断、日期过滤等功能
 支持A股、美股等不同市场的交易日历
 """
+import logging
+import threading
+import time
 from datetime import datetime, timedelta
-from typing import List, Tuple, Optional, Union
+from typing import Dict, List, Tuple, Optional, Union
+import numpy as np
 import pandas as pd
 
+logger = logging.getLogger(__name__)
+
+# 市场 -> pandas-market-calendars 日历名称
+MARKET_CALENDAR_NAMES = {
+    "CN": "XSHG",  # 上交所
+    "US": "XNYS",  # 纽交所
+    "HK": "XHKG",  # 港交所
+}
+# 交易日序数缓存覆盖范围：固定起点至今后一年
+_ORDINAL_CACHE_START = datetime(2000, 1, 1)
+_ORDINAL_CACHE_FORWARD_DAYS = 366
+# 构建交易日序数缓存失败后的退避秒数，期间直接走回退逻辑，不再反复构建日历
+_ORDINAL_BUILD_RETRY_SECONDS = 5 * 60
+# numpy datetime64[D] 以 1970-01-01 为 0，换算为 date.toordinal() 需加上该偏移
+_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+
+def _is_weekday_ord(ordinal: int) -> bool:
+    """按序数判断是否为工作日：序数 1 (0001-01-01) 为周一，(ordinal - 1) % 7 即 weekday()"""
+    return (ordinal - 1) % 7 < 5
+
+
+def _has_weekday_in_range(start_ord: int, end_ord: int) -> bool:
+    """闭区间 [start_ord, end_ord] 内是否存在工作日：连续三天及以上必然包含工作日"""
+    if end_ord < start_ord:
+        return False
+    if end_ord - start_ord >= 2:
+        return True
+    return any(_is_weekday_ord(o) for o in range(start_ord, end_ord + 1))
+
 
 class TradingDateUtils:
     """交易日期工具类"""
@@ -14,6 +48,14 @@ class TradingDateUtils:
     def __init__(self):
         """初始化交易日期工具"""
         self._pandas_market_calendars = None
+        # 按市场缓存有序交易日序数数组及其覆盖范围 (start_ord, end_ord)
+        self._trading_ord_arr: Dict[str, np.ndarray] = {}
+        self._trading_ord_bounds: Dict[str, Tuple[int, int]] = {}
+        # 同一批交易日序数的哈希集合，用于单日判断
+        self._trading_ordinals: Dict[str, frozenset] = {}
+        # 按市场记录最近一次构建失败的时间（monotonic），用于失败退避
+        self._trading_ord_failed_at: Dict[str, float] = {}
+        self._trading_ord_lock = threading.Lock()
         self._init_calendars()
 
     def _init_calendars(self):
@@ -22,9 +64,54 @@ class TradingDateUtils:
         try:
             import pandas_market_calendars as mcal
             self._pandas_market_calendars = mcal
-            print("已加载 pandas-market-calendars")
+            logger.info("已加载 pandas-market-calendars")
         except ImportError:
-            print("pandas-market-calendars 未安装，建议安装: conda install -c conda-forge pandas-market-calendars")
+            logger.warning("pandas-market-calendars 未安装，建议安装: conda install -c conda-forge pandas-market-calendars")
+
+    def _get_trading_ordinals(self, market: str) -> Optional[np.ndarray]:
+        """
+        懒加载指定市场的交易日序数（date.toordinal()）有序数组
+
+        日历库不可用或市场不受支持时返回 None，调用方需回退到逐日判断
+        """
+        arr = self._trading_ord_arr.get(market)
+        if arr is not None:
+            return arr
+        if not self._pandas_market_calendars or market not in MARKET_CALENDAR_NAMES:
+            return None
+        if self._in_build_backoff(market):
+            return None
+
+        with self._trading_ord_lock:
+            arr = self._trading_ord_arr.get(market)
+            if arr is not None:
+                return arr
+            if self._in_build_backoff(market):
+                return None
+            try:
+                cal = self._pandas_market_calendars.get_calendar(MARKET_CALENDAR_NAMES[market])
+                end_dt = datetime.now() + timedelta(days=_ORDINAL_CACHE_FORWARD_DAYS)
+                valid_days = cal.valid_days(start_date=_ORDINAL_CACHE_START, end_date=end_dt)
+                days = valid_days.tz_localize(None).values.astype('datetime64[D]').astype(np.int64)
+                arr = days + _EPOCH_ORDINAL
+            except Exception as e:
+                logger.warning("构建交易日序数缓存失败，%s 秒内不再重试: %s", _ORDINAL_BUILD_RETRY_SECONDS, e)
+                self._trading_ord_failed_at[market] = time.monotonic()
+                return None
+            self._trading_ord_bounds[market] = (_ORDINAL_CACHE_START.toordinal(), end_dt.toordinal())
+            self._trading_ordinals[market] = frozenset(arr.tolist())
+            self._trading_ord_arr[market] = arr
+            return arr
+
+    def _in_build_backoff(self, market: str) -> bool:
+        """最近一次构建失败仍在退避期内时返回 True"""
+        failed_at = self._trading_ord_failed_at.get(market)
+        return failed_at is not None and time.monotonic() - failed_at < _ORDINAL_BUILD_RETRY_SECONDS
+
+    def _covers(self, market: str, start_ord: int, end_ord: int) -> bool:
+        """判断序数缓存是否完整覆盖 [start_ord, end_ord]"""
+        bounds = self._trading_ord_bounds.get(market)
+        return bounds is not None and bounds[0] <= start_ord and end_ord <= bounds[1]
 
     def is_trading_day(self, date: Union[str, datetime], market: str = "CN") -> bool:
         """
@@ -40,6 +127,12 @@ class TradingDateUtils:
         if isinstance(date, str):
             date = datetime.strptime(date.replace('-', ''), '%Y%m%d')
 
+        # 命中序数缓存时直接做集合查找，不再构造 pd.Timestamp 并查询日历
+        if self._get_trading_ordinals(market) is not None:
+            date_ord = date.toordinal()
+            if self._covers(market, date_ord, date_ord):
+                return date_ord in self._trading_ordinals[market]
+
         # 使用 pandas-market-calendars
         if self._pandas_market_calendars:
             try:
@@ -53,8 +146,8 @@ class TradingDateUtils:
                     # 香港市场 - 港交所日历
                     cal = self._pandas_market_calendars.get_calendar('XHKG')
                 else:
-                    print(f"不支持的市场类型: {market}")
-                    return self._is_weekday(date)
+                    logger.debug("不支持的市场类型: %s", market)
+                    return _is_weekday_ord(date.toordinal())
 
                 # 使用 valid_days 方法
                 pd_date = pd.Timestamp(date)
@@ -62,14 +155,10 @@ class TradingDateUtils:
                 return len(valid_days) > 0
 
             except Exception as e:
-                print(f"使用 pandas-market-calendars 判断失败: {e}")
+                logger.warning("使用 pandas-market-calendars 判断失败: %s", e)
 
         # 回退到简单的工作日判断
-        return self._is_weekday(date)
-
-    def _is_weekday(self, date: datetime) -> bool:
-        """简单的工作日判断（周一到周五）"""
-        return date.weekday() < 5
+        return _is_weekday_ord(date.toordinal())
 
     def filter_trading_days(self, date_ranges: List[Tuple[str, str]], market: str = "CN") -> List[Tuple[str, str]]:
         """
@@ -89,7 +178,7 @@ class TradingDateUtils:
             if self._has_trading_days_in_range(start_date, end_date, market):
                 filtered_ranges.append((start_date, end_date))
             else:
-                print(f"跳过非交易日范围: {start_date} ~ {end_date}")
+                logger.debug("跳过非交易日范围: %s ~ %s", start_date, end_date)
 
         return filtered_ranges
 
@@ -98,6 +187,18 @@ class TradingDateUtils:
         start_dt = datetime.strptime(start_date.replace('-', ''), '%Y%m%d')
         end_dt = datetime.strptime(end_date.replace('-', ''), '%Y%m%d')
 
+        # 有序数缓存时，二分查找首个 >= start 的交易日即可判定
+        arr = self._get_trading_ordinals(market)
+        start_ord = start_dt.toordinal()
+        end_ord = end_dt.toordinal()
+        if arr is not None and self._covers(market, start_ord, end_ord):
+            idx = np.searchsorted(arr, start_ord, side='left')
+            return bool(idx < len(arr) and arr[idx] <= end_ord)
+
+        # 没有可用日历时按工作日判断，直接用区间长度得出结论
+        if arr is None:
+            return _has_weekday_in_range(start_ord, end_ord)
+
         # 逐日检查（最多检查30天，避免效率问题）
         current_dt = start_dt
         check_count = 0
@@ -111,6 +212,18 @@ class TradingDateUtils:
 
         return False
 
+    def _next_trading_day_from_ordinals(self, date: datetime, market: str) -> Optional[datetime]:
+        """二分查找序数缓存得出下一交易日；缓存无法回答时返回 None"""
+        arr = self._get_trading_ordinals(market)
+        date_ord = date.toordinal()
+        if arr is None or not self._covers(market, date_ord, date_ord):
+            return None
+        idx = int(np.searchsorted(arr, date_ord, side='right'))
+        if idx >= len(arr):
+            return None
+        # 与 valid_days 返回值保持一致：UTC 时区的当日零点
+        return pd.Timestamp(datetime.fromordinal(int(arr[idx])), tz='UTC').to_pydatetime()
+
     def get_next_trading_day(self, date: Union[str, datetime], market: str = "CN") -> Optional[datetime]:
         """
         获取下一个交易日
@@ -125,6 +238,10 @@ class TradingDateUtils:
         if isinstance(date, str):
             date = datetime.strptime(date.replace('-', ''), '%Y%m%d')
 
+        next_day = self._next_trading_day_from_ordinals(date, market)
+        if next_day is not None:
+            return next_day
+
         # 使用 pandas-market-calendars
         if self._pandas_market_calendars:
             try:
@@ -146,7 +263,7 @@ class TradingDateUtils:
                     return valid_days[0].to_pydatetime()
 
             except Exception as e:
-                print(f"使用 pandas-market-calendars 获取下一交易日失败: {e}")
+                logger.warning("使用 pandas-market-calendars 获取下一交易日失败: %s", e)
 
         # 回退到简单搜索
         return self._simple_next_trading_day(date)
@@ -175,6 +292,11 @@ class TradingDateUtils:
         Returns:
             List[str]: 交易日列表
         """
+        # 命中序数缓存时二分切片，不再每次构造日历并调用 valid_days
+        ords = self._slice_trading_ordinals(start_date, end_date, market)
+        if ords is not None:
+            return self._ordinals_to_dates(ords)
+
         # 使用 pandas-market-calendars
         if self._pandas_market_calendars:
             try:
@@ -194,25 +316,62 @@ class TradingDateUtils:
                 return [day.strftime('%Y-%m-%d') for day in trading_days]
 
             except Exception as e:
-                print(f"使用 pandas-market-calendars 获取交易日列表失败: {e}")
+                logger.warning("使用 pandas-market-calendars 获取交易日列表失败: %s", e)
 
         # 回退到工作日
         return self._get_weekdays_in_range(start_date, end_date)
 
+    def _slice_trading_ordinals(self, start_date: str, end_date: str, market: str) -> Optional[np.ndarray]:
+        """从序数缓存中二分截取 [start_date, end_date] 内的交易日序数；缓存无法覆盖时返回 None"""
+        arr = self._get_trading_ordinals(market)
+        if arr is None:
+            return None
+        start_ord = datetime.strptime(start_date.replace('-', ''), '%Y%m%d').toordinal()
+        end_ord = datetime.strptime(end_date.replace('-', ''), '%Y%m%d').toordinal()
+        if not self._covers(market, start_ord, end_ord):
+            return None
+        lo = np.searchsorted(arr, start_ord, side='left')
+        hi = np.searchsorted(arr, end_ord, side='right')
+        return arr[lo:hi]
+
+    @staticmethod
+    def _ordinals_to_dates(ords: np.ndarray) -> List[str]:
+        """交易日序数数组转为 YYYY-MM-DD 字符串列表"""
+        return (ords - _EPOCH_ORDINAL).astype('datetime64[D]').astype(str).tolist()
+
+    def get_trading_days_union(self, start_date: str, end_date: str,
+                               markets: Tuple[str, ...] = ("CN", "HK")) -> List[str]:
+        """
+        获取日期范围内多个市场交易日的并集（升序）
+
+        Args:
+            start_date: 开始日期
+            end_date: 结束日期
+            markets: 市场类型列表
+
+        Returns:
+            List[str]: 交易日列表
+        """
+        # 序数缓存覆盖时直接合并各市场的切片，不再逐市场查询日历
+        slices = [self._slice_trading_ordinals(start_date, end_date, market) for market in markets]
+        if all(ords is not None for ords in slices):
+            ords = np.unique(np.concatenate(slices)) if slices else np.empty(0, dtype=np.int64)
+            return self._ordinals_to_dates(ords)
+
+        days = set()
+        for market in markets:
+            days.update(self.get_trading_days_in_range(start_date, end_date, market=market))
+        return sorted(days)
+
     def _get_weekdays_in_range(self, start_date: str, end_date: str) -> List[str]:
         """获取日期范围内的工作日"""
         start_dt = datetime.strptime(start_date.replace('-', ''), '%Y%m%d')
         end_dt = datetime.strptime(end_date.replace('-', ''), '%Y%m%d')
 
-        weekdays = []
-        current_dt = start_dt
-
-        while current_dt <= end_dt:
-            if current_dt.weekday() < 5:  # 周一到周五
-                weekdays.append(current_dt.strftime('%Y-%m-%d'))
-            current_dt += timedelta(days=1)
-
-        return weekdays
+        # 一次性生成序数区间并用 (ordinal - 1) % 7 < 5 得到周一到周五的掩码
+        ords = np.arange(start_dt.toordinal(), end_dt.toordinal() + 1, dtype=np.int64)
+        weekday_ords = ords[(ords - 1) % 7 < 5]
+        return (weekday_ords - _EPOCH_ORDINAL).astype('datetime64[D]').astype(str).tolist()
 
 
 # 创建全局实例
@@ -1,21 +1,57 @@
+import atexit
 import logging
 import math
 import re
 import threading
 import time
 import socket
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import zip_longest
+from concurrent.futures import ThreadPoolExecutor
 
 from futu import *
 from datetime import date, datetime, timedelta
+import numpy as np
 import pandas as pd
 from typing import Dict, List, Optional, Tuple
 import os
+from dotenv import load_dotenv
 
-from app.utils.futu_rate_limiter import financial_api_rate_limiter
-from app.utils.ttl_cache import LEADER_STOCK_METRICS_TTL_SECONDS, leader_stock_metrics_cache
+from app.utils.futu_rate_limiter import (
+    financial_api_rate_limiter,
+    history_kline_rate_limiter,
+    stock_filter_rate_limiter,
+)
+from app.utils.ttl_cache import (
+    ABOVE_MA20_TTL_SECONDS,
+    LEADER_STOCK_METRICS_TTL_SECONDS,
+    PLATE_STOCKS_TTL_SECONDS,
+    above_ma20_cache,
+    leader_stock_metrics_cache,
+    plate_stocks_cache,
+)
 
 logger = logging.getLogger(__name__)
 
+# 富途连接配置进程内不变，导入时读取一次，避免订阅与取上下文的热路径反复读环境变量
+load_dotenv()
+
+
+def _read_int_env(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)) or default)
+    except Exception:
+        return default
+
+
+# 订阅上限，富途订阅额度默认 300
+_SUB_LIMIT = max(1, _read_int_env('FUTU_SUBSCRIPTION_LIMIT', 300))
+# 行情上下文最长存活秒数，<=0 表示不轮换
+_CTX_MAX_AGE = _read_int_env('FUTU_QUOTE_CTX_MAX_AGE_SEC', 1800)
+_FUTU_HOST = os.getenv('FUTU_HOST', '127.0.0.1')
+_FUTU_PORT = _read_int_env('FUTU_PORT', 11111)
+
 # 获取今天的日期并格式化
 formatted_date = date.today().strftime('%Y%m%d')
 
@@ -29,6 +65,34 @@ plate_code_name = {
     'SH.LIST0600': '大A'
 }
 
+# get_stock_data 使用的快照数值列
+QUOTE_VALUE_COLUMNS = [
+    'last_price', 'prev_close_price', 'volume', 'turnover', 'pe_ratio', 'volume_ratio', 'turnover_rate'
+]
+# get_stock_data 输出字段：源列名 -> 输出列名
+STOCK_DATA_COLUMNS = {
+    'code': 'code',
+    'stock_name': 'name',
+    'changeRatio': 'changeRatio',
+    'volume': 'volume',
+    'turnover': 'amount',
+    'pe_ratio': 'pe',
+    'volume_ratio': 'volumeRatio',
+    'turnover_rate': 'turnoverRate'
+}
+# get_stock_current_price 使用的报价数值列
+CURRENT_PRICE_COLUMNS = [
+    'last_price', 'prev_close_price', 'volume', 'turnover', 'open_price', 'high_price', 'low_price'
+]
+# get_stock_history_kline 支持的 K 线周期
+_KTYPE_MAPPING = {
+    "K_DAY": KLType.K_DAY,
+    "K_WEEK": KLType.K_WEEK,
+    "K_MON": KLType.K_MON,
+    "K_QUARTER": KLType.K_QUARTER,
+    "K_YEAR": KLType.K_YEAR
+}
+
 
 # ============================================
 # 共享 FutuQuoteContext（单例复用，避免每次调用都建立 TCP 连接）
@@ -39,14 +103,40 @@ _quote_ctx_lock = threading.Lock()
 _quote_ctx_created_at = 0.0
 _quote_ctx_unavailable_until = 0.0
 _quote_ctx_unavailable_reason = ''
-_subscription_lock = threading.Lock()
-_active_subscriptions: Dict[Tuple[str, SubType], float] = {}
+# 上下文租用计数（id(ctx) -> 在用次数）；轮换下线时仍被租用的旧上下文由最后一个归还者关闭
+_quote_ctx_leases: Dict[int, int] = {}
+_retired_quote_ctxs: Dict[int, "OpenQuoteContext"] = {}
+_quote_ctx_lease_cond = threading.Condition()
+# 退出时等待在用上下文归还的最长秒数
+_QUOTE_CTX_CLOSE_WAIT_SEC = 5.0
+# 订阅记录按 code 哈希分片，每片独立加锁；片内按最近使用排序（队首最久未使用），用于 LRU 释放
+_SUBSCRIPTION_STRIPES = 16
+_subscription_stripes: List[Tuple["OrderedDict[Tuple[str, SubType], None]", threading.Lock]] = [
+    (OrderedDict(), threading.Lock()) for _ in range(_SUBSCRIPTION_STRIPES)
+]
 
 
 def _sub_key(code: str, sub_type: SubType) -> Tuple[str, SubType]:
     return code, sub_type
 
 
+def _sub_stripe(code: str) -> Tuple["OrderedDict[Tuple[str, SubType], None]", threading.Lock]:
+    return _subscription_stripes[hash(code) % _SUBSCRIPTION_STRIPES]
+
+
+def _group_by_stripe(code_list: List[str]) -> Dict[int, List[str]]:
+    grouped: Dict[int, List[str]] = {}
+    for code in code_list:
+        grouped.setdefault(hash(code) % _SUBSCRIPTION_STRIPES, []).append(code)
+    return grouped
+
+
+def _clear_subscriptions():
+    for stripe, lock in _subscription_stripes:
+        with lock:
+            stripe.clear()
+
+
 def _get_futu_connect_timeout_sec() -> float:
     """
     富途端口可达性探测超时，默认 0.3 秒，避免阻塞业务接口。
@@ -99,17 +189,6 @@ def _build_price_fallback(code: str) -> Dict:
     }
 
 
-def _get_subscription_limit() -> int:
-    """
-    读取订阅上限。富途订阅额度默认 300，可通过环境变量覆盖。
-    """
-    try:
-        value = int(os.getenv('FUTU_SUBSCRIPTION_LIMIT', '300'))
-        return max(1, value)
-    except Exception:
-        return 300
-
-
 def _evict_old_subscriptions_if_needed(quote_context, sub_type: SubType, incoming_count: int):
     """
     在订阅新标的前，按最久未使用优先释放旧订阅，避免超过额度。
@@ -117,29 +196,32 @@ def _evict_old_subscriptions_if_needed(quote_context, sub_type: SubType, incomin
     if incoming_count <= 0:
         return
 
-    limit = _get_subscription_limit()
-    with _subscription_lock:
-        used = len(_active_subscriptions)
-        available = max(0, limit - used)
-        need_release = incoming_count - available
-        if need_release <= 0:
-            return
+    limit = _SUB_LIMIT
+    # 逐片在各自锁内快照，不持有全局锁；跨片只能近似 LRU
+    snapshots = []
+    for stripe, lock in _subscription_stripes:
+        with lock:
+            snapshots.append(list(stripe))
+    used = sum(len(keys) for keys in snapshots)
+    available = max(0, limit - used)
+    need_release = incoming_count - available
+    if need_release <= 0:
+        return
 
-        # 先从同类型订阅中释放，仍不足时再从其他类型补齐
-        same_type = sorted(
-            [(key, ts) for key, ts in _active_subscriptions.items() if key[1] == sub_type],
-            key=lambda x: x[1]
-        )
-        candidates = same_type[:need_release]
-        if len(candidates) < need_release:
-            others = sorted(
-                [(key, ts) for key, ts in _active_subscriptions.items() if key[1] != sub_type],
-                key=lambda x: x[1]
-            )
-            candidates.extend(others[:need_release - len(candidates)])
+    # 先从同类型订阅中释放，仍不足时再从其他类型补齐；各片轮流取最久未使用的一条
+    candidates = []
+    for same_type in (True, False):
+        per_stripe = [[key for key in keys if (key[1] == sub_type) == same_type] for keys in snapshots]
+        for round_keys in zip_longest(*per_stripe):
+            candidates.extend(key for key in round_keys if key is not None)
+            if len(candidates) >= need_release:
+                break
+        if len(candidates) >= need_release:
+            candidates = candidates[:need_release]
+            break
 
     grouped_codes: Dict[SubType, List[str]] = {}
-    for (code, old_type), _ in candidates:
+    for code, old_type in candidates:
         grouped_codes.setdefault(old_type, []).append(code)
 
     for old_type, code_list in grouped_codes.items():
@@ -150,9 +232,10 @@ def _evict_old_subscriptions_if_needed(quote_context, sub_type: SubType, incomin
         except Exception as exc:
             logger.warning(f"释放订阅失败，类型={old_type}, 数量={len(code_list)}: {exc}")
             continue
-        with _subscription_lock:
-            for code in code_list:
-                _active_subscriptions.pop(_sub_key(code, old_type), None)
+        for code in code_list:
+            stripe, lock = _sub_stripe(code)
+            with lock:
+                stripe.pop(_sub_key(code, old_type), None)
         logger.info(f"已释放订阅 {len(code_list)} 个，类型={old_type}")
 
 
@@ -162,28 +245,49 @@ def _subscribe_if_needed(quote_context, code_list: List[str], sub_type: SubType)
     """
     if not code_list:
         return RET_OK, ''
-
-    now = time.time()
-    with _subscription_lock:
-        need_subscribe = []
-        for code in code_list:
-            key = _sub_key(code, sub_type)
-            if key not in _active_subscriptions:
-                need_subscribe.append(code)
-            else:
-                # 已订阅也刷新最近使用时间，便于后续按 LRU 释放
-                _active_subscriptions[key] = now
+    # 外部调用方可能传入重复代码，保序去重后再查表，避免重复占用额度
+    code_list = list(dict.fromkeys(code_list))
+
+    # 订阅表只记录当前连接的订阅；租用中的已退役连接直接订阅，不查表也不记录
+    if quote_context is not _quote_ctx:
+        return quote_context.subscribe(code_list, [sub_type], subscribe_push=False)
+
+    need_subscribe = []
+    grouped = _group_by_stripe(code_list)
+    for stripe_idx, stripe_codes in grouped.items():
+        stripe, lock = _subscription_stripes[stripe_idx]
+        with lock:
+            for code in stripe_codes:
+                key = _sub_key(code, sub_type)
+                if key not in stripe:
+                    need_subscribe.append(code)
+                else:
+                    # 已订阅也移到队尾标记为最近使用，便于后续按 LRU 释放
+                    stripe.move_to_end(key)
 
     if not need_subscribe:
         return RET_OK, ''
 
-    _evict_old_subscriptions_if_needed(quote_context, sub_type, len(need_subscribe))
+    return _subscribe_codes(quote_context, need_subscribe, sub_type)
+
 
-    ret_sub, err_message = quote_context.subscribe(need_subscribe, [sub_type], subscribe_push=False)
+def _subscribe_codes(quote_context, code_list: List[str], sub_type: SubType):
+    # 富途订阅后 60 秒内不能退订，超过额度的列表无法靠轮换释放分批完成，直接报错
+    if len(code_list) > _SUB_LIMIT:
+        return RET_ERROR, f"订阅数量 {len(code_list)} 超过额度 {_SUB_LIMIT}"
+
+    _evict_old_subscriptions_if_needed(quote_context, sub_type, len(code_list))
+
+    ret_sub, err_message = quote_context.subscribe(code_list, [sub_type], subscribe_push=False)
     if ret_sub == RET_OK:
-        with _subscription_lock:
-            for code in need_subscribe:
-                _active_subscriptions[_sub_key(code, sub_type)] = now
+        for stripe_idx, stripe_codes in _group_by_stripe(code_list).items():
+            stripe, lock = _subscription_stripes[stripe_idx]
+            with lock:
+                # 订阅期间连接可能已轮换并清空订阅表，此时不能把旧连接的订阅记到新连接名下
+                if quote_context is not _quote_ctx:
+                    break
+                for code in stripe_codes:
+                    stripe[_sub_key(code, sub_type)] = None
     return ret_sub, err_message
 
 
@@ -193,28 +297,30 @@ def get_quote_context() -> OpenQuoteContext:
     连接断开时自动重建；连接存活过久时轮换重建，避免状态长期累积。
     """
     global _quote_ctx, _quote_ctx_created_at, _quote_ctx_unavailable_until, _quote_ctx_unavailable_reason
+    # 快路径：上下文存活且未到轮换时间时无锁直接返回，只有新建/轮换才进入加锁的慢路径
+    quote_ctx = _quote_ctx
+    if quote_ctx is not None and (_CTX_MAX_AGE <= 0 or time.time() - _quote_ctx_created_at < _CTX_MAX_AGE):
+        return quote_ctx
+
     with _quote_ctx_lock:
         now = time.time()
         if _quote_ctx is None and now < _quote_ctx_unavailable_until:
             raise TimeoutError(_quote_ctx_unavailable_reason or "Futu quote service temporarily unavailable")
 
-        max_age_sec = int(os.getenv('FUTU_QUOTE_CTX_MAX_AGE_SEC', '1800'))
+        max_age_sec = _CTX_MAX_AGE
         if _quote_ctx is not None and max_age_sec > 0:
             alive_sec = now - _quote_ctx_created_at
             if alive_sec >= max_age_sec:
-                try:
-                    _quote_ctx.close()
-                except Exception:
-                    pass
+                retired_ctx = _quote_ctx
                 _quote_ctx = None
                 _quote_ctx_created_at = 0.0
-                with _subscription_lock:
-                    _active_subscriptions.clear()
+                _retire_quote_context(retired_ctx)
+                _clear_subscriptions()
                 logger.info(f"FutuQuoteContext recycled after {alive_sec:.0f}s")
 
         if _quote_ctx is None:
-            futu_host = os.getenv('FUTU_HOST', '127.0.0.1')
-            futu_port = int(os.getenv('FUTU_PORT', '11111'))
+            futu_host = _FUTU_HOST
+            futu_port = _FUTU_PORT
             connect_timeout_sec = _get_futu_connect_timeout_sec()
             ok, reason = _probe_futu_gateway(futu_host, futu_port, connect_timeout_sec)
             if not ok:
@@ -233,22 +339,81 @@ def get_quote_context() -> OpenQuoteContext:
         return _quote_ctx
 
 
+def _close_quote_ctx_quietly(quote_ctx):
+    try:
+        quote_ctx.close()
+    except Exception:
+        pass
+
+
+def _retire_quote_context(quote_ctx, wait_sec: float = 0.0):
+    """
+    下线旧上下文：无人租用时立即关闭。
+    仍被租用时，wait_sec>0 则最多等待该时长后关闭，否则交给最后一个归还者关闭，避免关掉正在请求中的连接。
+    """
+    key = id(quote_ctx)
+    with _quote_ctx_lease_cond:
+        if wait_sec > 0:
+            _quote_ctx_lease_cond.wait_for(lambda: not _quote_ctx_leases.get(key), timeout=wait_sec)
+        elif _quote_ctx_leases.get(key):
+            _retired_quote_ctxs[key] = quote_ctx
+            return
+        _retired_quote_ctxs.pop(key, None)
+    _close_quote_ctx_quietly(quote_ctx)
+
+
+def _release_quote_context_lease(key: int):
+    retired_ctx = None
+    with _quote_ctx_lease_cond:
+        remaining = _quote_ctx_leases.get(key, 0) - 1
+        if remaining > 0:
+            _quote_ctx_leases[key] = remaining
+        else:
+            _quote_ctx_leases.pop(key, None)
+            retired_ctx = _retired_quote_ctxs.pop(key, None)
+            _quote_ctx_lease_cond.notify_all()
+    if retired_ctx is not None:
+        _close_quote_ctx_quietly(retired_ctx)
+
+
+@contextmanager
+def quote_context_lease():
+    """
+    租用共享行情上下文，with 块内保证该上下文不会被轮换或重置关闭。
+    用法：with quote_context_lease() as quote_ctx: ...
+    """
+    while True:
+        quote_ctx = get_quote_context()
+        key = id(quote_ctx)
+        with _quote_ctx_lease_cond:
+            _quote_ctx_leases[key] = _quote_ctx_leases.get(key, 0) + 1
+            # 取到后若已被轮换下线，则归还并重取，避免租到即将关闭的旧上下文
+            current = quote_ctx is _quote_ctx
+        if current:
+            break
+        _release_quote_context_lease(key)
+    try:
+        yield quote_ctx
+    finally:
+        _release_quote_context_lease(key)
+
+
 def _reset_quote_context():
     """连接异常时重置上下文，下次调用 get_quote_context 会重建"""
-    global _quote_ctx, _quote_ctx_created_at, _active_subscriptions, _quote_ctx_unavailable_until, _quote_ctx_unavailable_reason
+    global _quote_ctx, _quote_ctx_created_at, _quote_ctx_unavailable_until, _quote_ctx_unavailable_reason
+    retired_ctx = None
     with _quote_ctx_lock:
         if _quote_ctx is not None:
-            try:
-                _quote_ctx.close()
-            except Exception:
-                pass
+            retired_ctx = _quote_ctx
             _quote_ctx = None
             _quote_ctx_created_at = 0.0
             logger.info("FutuQuoteContext reset due to error")
         _quote_ctx_unavailable_until = 0.0
         _quote_ctx_unavailable_reason = ''
-    with _subscription_lock:
-        _active_subscriptions = {}
+    # 在锁外等待在用请求归还，避免阻塞其他线程重建上下文
+    if retired_ctx is not None:
+        _retire_quote_context(retired_ctx, wait_sec=_QUOTE_CTX_CLOSE_WAIT_SEC)
+    _clear_subscriptions()
 
 
 def close_quote_context():
@@ -256,6 +421,9 @@ def close_quote_context():
     _reset_quote_context()
 
 
+atexit.register(close_quote_context)
+
+
 def get_hot_top(quote_context, plate_code: str, sort_field: str, top: int = 50):
     """
     获取热门股票数据
@@ -263,16 +431,35 @@ def get_hot_top(quote_context, plate_code: str, sort_field: str, top: int = 50):
     :param plate_code: 板块代码
     :param sort_field: 排序字段
     :param top: 获取前多少名
-    :return: DataFrame 包含股票数据
+    :return: DataFrame，仅含 code、stock_name 两列
     """
     ret, data = quote_context.get_plate_stock(plate_code=plate_code, sort_field=sort_field, ascend=False)
     if ret == RET_OK:
-        return data.head(top)
+        # 下游只用代码和名称
+        return data.head(top)[['code', 'stock_name']].reset_index(drop=True)
     else:
         print('error:', data)
         return pd.DataFrame()
 
 
+def get_hot_tops(quote_context, plate_code: str, sort_fields: List[str], top: int = 50) -> Dict[str, pd.DataFrame]:
+    """
+    一次性获取同一板块在多个排序字段下的热门股票
+    get_plate_stock 返回的板块成分不含行情字段，无法本地重排，因此各排序仍需单独请求，这里并发发出
+    :param quote_context: 行情上下文
+    :param plate_code: 板块代码
+    :param sort_fields: 排序字段列表
+    :param top: 获取前多少名
+    :return: {排序字段: DataFrame}
+    """
+    with ThreadPoolExecutor(max_workers=max(1, len(sort_fields))) as executor:
+        futures = {
+            sort_field: executor.submit(get_hot_top, quote_context, plate_code, sort_field, top)
+            for sort_field in sort_fields
+        }
+        return {sort_field: future.result() for sort_field, future in futures.items()}
+
+
 def get_stock_quote(quote_context, code_list:list[str]):
     """
     获取股票报价数据
@@ -283,11 +470,7 @@ def get_stock_quote(quote_context, code_list:list[str]):
     if not code_list:
         return pd.DataFrame()
 
-    ret_sub, err_message = _subscribe_if_needed(quote_context, code_list, SubType.QUOTE)
-    if ret_sub != RET_OK:
-        print('subscription failed', err_message)
-        return pd.DataFrame()
-
+    # 快照接口无需订阅，直接请求，省去一次订阅往返且不占用订阅额度
     ret, data = quote_context.get_market_snapshot(code_list)
     if ret == RET_OK:
         return data
@@ -301,8 +484,11 @@ def get_realtime_quotes_by_futu_codes(code_list: List[str]) -> pd.DataFrame:
     按富途代码批量获取实时快照。
     :param code_list: 如 ['SH.600519', 'SZ.000001']
     """
-    quote_context = get_quote_context()
-    return get_stock_quote(quote_context, code_list)
+    with quote_context_lease() as quote_context:
+        return get_stock_quote(quote_context, code_list)
+
+
+_SNAPSHOT_BATCH_WORKERS = 4
 
 
 def get_market_snapshots_by_futu_codes(code_list: List[str], batch_size: int = 400) -> pd.DataFrame:
@@ -336,131 +522,94 @@ def get_market_snapshots_by_futu_codes(code_list: List[str], batch_size: int = 4
     if not filtered_codes:
         return pd.DataFrame()
 
-    quote_context = get_quote_context()
-    safe_batch_size = max(1, min(int(batch_size), 400))
+    with quote_context_lease() as quote_context:
+        safe_batch_size = max(1, min(int(batch_size), 400))
+        batches = [
+            filtered_codes[start:start + safe_batch_size]
+            for start in range(0, len(filtered_codes), safe_batch_size)
+        ]
 
-    chunks: List[pd.DataFrame] = []
-    for start in range(0, len(filtered_codes), safe_batch_size):
-        batch_codes = filtered_codes[start:start + safe_batch_size]
-        ret, data = quote_context.get_market_snapshot(batch_codes)
-        if ret != RET_OK:
-            raise Exception(f"获取市场快照失败: {data}")
-        if not data.empty:
-            chunks.append(data)
+        def fetch_batch(batch_codes: List[str]) -> pd.DataFrame:
+            ret, data = quote_context.get_market_snapshot(batch_codes)
+            if ret != RET_OK:
+                raise Exception(f"获取市场快照失败: {data}")
+            return data
 
-    if not chunks:
-        return pd.DataFrame()
-    return pd.concat(chunks, ignore_index=True)
+        # 多批时在同一上下文上并发请求，map 保持批次顺序
+        if len(batches) == 1:
+            results = [fetch_batch(batches[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(_SNAPSHOT_BATCH_WORKERS, len(batches))) as executor:
+                results = list(executor.map(fetch_batch, batches))
+        chunks = [data for data in results if not data.empty]
 
+        if not chunks:
+            return pd.DataFrame()
+        # 单批（≤400 只）时直接返回，避免 concat 再整表复制一次
+        if len(chunks) == 1:
+            return chunks[0].reset_index(drop=True)
+        return pd.concat(chunks, ignore_index=True)
 
-def get_stock_data(plate_code: str) -> Dict[str, List[Dict]]:
+
+def get_stock_data(plate_code: str, quote_context=None) -> Dict[str, List[Dict]]:
     """
     获取股票数据，包括涨幅和成交额排名
     :param plate_code: 板块代码
+    :param quote_context: 行情上下文，默认使用共享上下文
     :return: 包含涨幅和成交额排名的字典
     """
     try:
-        quote_context = get_quote_context()
+        if quote_context is None:
+            with quote_context_lease() as quote_context:
+                return get_stock_data(plate_code, quote_context)
         
-        # 获取涨幅前50
-        change_rate_df = get_hot_top(quote_context, plate_code, 'CHANGE_RATE', 50)
-        # 获取成交额前50
-        turnover_top50_df = get_hot_top(quote_context, plate_code, 'TURNOVER', 50)
+        # 同时获取涨幅前50与成交额前50
+        hot_tops = get_hot_tops(quote_context, plate_code, ['CHANGE_RATE', 'TURNOVER'], 50)
+        change_rate_df = hot_tops['CHANGE_RATE']
+        turnover_top50_df = hot_tops['TURNOVER']
         
         # 收集所有需要获取详细数据的股票代码
-        all_codes = set()
-        all_codes.update(change_rate_df['code'].tolist())
-        all_codes.update(turnover_top50_df['code'].tolist())
-        all_codes = list(all_codes)
+        all_codes = pd.unique(np.concatenate([
+            change_rate_df['code'].to_numpy(),
+            turnover_top50_df['code'].to_numpy()
+        ])).tolist()
         
         # 一次性获取所有股票的详细数据
         quote_data = get_stock_quote(quote_context, all_codes)
         
-        # 处理数据
-        def process_df(df):
+        # 处理数据：报价按 code 去重（与取首条一致）后建立位置索引，数值列整体取为 numpy 块，
+        # 涨跌幅在整张快照上一次算好作为末列；末尾追加一行 NaN，get_indexer 对未命中返回的 -1 恰好落在该行
+        quote_frame = quote_data.reindex(columns=['code'] + QUOTE_VALUE_COLUMNS).drop_duplicates(subset='code')
+        quote_index = pd.Index(quote_frame['code'])
+        quote_block = quote_frame[QUOTE_VALUE_COLUMNS].to_numpy(dtype=float)
+        last_price = quote_block[:, QUOTE_VALUE_COLUMNS.index('last_price')]
+        prev_close = quote_block[:, QUOTE_VALUE_COLUMNS.index('prev_close_price')]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change_ratio = np.where(prev_close > 0, (last_price - prev_close) / prev_close * 100, 0)
+        value_columns = QUOTE_VALUE_COLUMNS + ['changeRatio']
+        quote_values = np.vstack([
+            np.column_stack([quote_block, change_ratio]),
+            np.full((1, len(value_columns)), np.nan)
+        ])
+
+        def build_frame(df):
             if df.empty:
-                return []
-            result = []
-            for _, row in df.iterrows():
-                code = row['code']
-                quote_row = quote_data[quote_data['code'] == code].iloc[0] if not quote_data.empty else None
-                
-                # 计算涨跌幅
-                change_ratio = 0
-                if quote_row is not None:
-                    last_price = quote_row['last_price']
-                    prev_close = quote_row['prev_close_price']
-                    if prev_close > 0:
-                        change_ratio = (last_price - prev_close) / prev_close * 100
-                
-                # 获取量比数据
-                volume_ratio = 0
-                if quote_row is not None and 'volume_ratio' in quote_row:
-                    volume_ratio = quote_row['volume_ratio']
-                
-                # 获取换手率数据
-                turnover_rate = 0
-                if quote_row is not None and 'turnover_rate' in quote_row:
-                    turnover_rate = quote_row['turnover_rate']
-                
-                stock_data = {
-                    'code': code,
-                    'name': row['stock_name'],
-                    'changeRatio': change_ratio,
-                    'volume': quote_row['volume'] if quote_row is not None else 0,
-                    'amount': quote_row['turnover'] if quote_row is not None else 0,
-                    'pe': quote_row['pe_ratio'] if quote_row is not None and 'pe_ratio' in quote_row else 0,
-                    'volumeRatio': volume_ratio,
-                    'turnoverRate': turnover_rate
-                }
-                result.append(stock_data)
-            return result
-        
-        # 计算交集
-        change_rate_codes = set(change_rate_df['code'])
-        turnover_codes = set(turnover_top50_df['code'])
-        intersection_codes = list(change_rate_codes & turnover_codes)
-        
-        # 获取交集数据
-        intersection_data = []
-        for code in intersection_codes:
-            change_rate_row = change_rate_df[change_rate_df['code'] == code].iloc[0]
-            quote_row = quote_data[quote_data['code'] == code].iloc[0] if not quote_data.empty else None
-            
-            # 计算涨跌幅
-            change_ratio = 0
-            if quote_row is not None:
-                last_price = quote_row['last_price']
-                prev_close = quote_row['prev_close_price']
-                if prev_close > 0:
-                    change_ratio = (last_price - prev_close) / prev_close * 100
-            
-            # 获取量比数据
-            volume_ratio = 0
-            if quote_row is not None and 'volume_ratio' in quote_row:
-                volume_ratio = quote_row['volume_ratio']
-            
-            # 获取换手率数据
-            turnover_rate = 0
-            if quote_row is not None and 'turnover_rate' in quote_row:
-                turnover_rate = quote_row['turnover_rate']
-            
-            stock_data = {
-                'code': code,
-                'name': change_rate_row['stock_name'],
-                'changeRatio': change_ratio,
-                'volume': quote_row['volume'] if quote_row is not None else 0,
-                'amount': quote_row['turnover'] if quote_row is not None else 0,
-                'pe': quote_row['pe_ratio'] if quote_row is not None and 'pe_ratio' in quote_row else 0,
-                'volumeRatio': volume_ratio,
-                'turnoverRate': turnover_rate
-            }
-            intersection_data.append(stock_data)
-        
+                return pd.DataFrame(columns=list(STOCK_DATA_COLUMNS.values()))
+            values = quote_values[quote_index.get_indexer(df['code'])]
+            frame = pd.DataFrame(np.nan_to_num(values, nan=0.0), columns=value_columns)
+            frame['code'] = df['code'].to_numpy()
+            frame['stock_name'] = df['stock_name'].to_numpy()
+            return frame.rename(columns=STOCK_DATA_COLUMNS)[list(STOCK_DATA_COLUMNS.values())]
+
+        top_change = build_frame(change_rate_df)
+        top_turnover = build_frame(turnover_top50_df)
+        # 交集直接从涨幅榜结果中按成交额榜成员过滤，复用同一份计算结果
+        intersection = top_change[top_change['code'].isin(top_turnover['code'])]
+
         return {
-            'top_change': process_df(change_rate_df),
-            'top_turnover': process_df(turnover_top50_df),
-            'intersection': intersection_data
+            'top_change': top_change.to_dict('records'),
+            'top_turnover': top_turnover.to_dict('records'),
+            'intersection': intersection.to_dict('records')
         }
         
     except Exception as e:
@@ -477,10 +626,14 @@ def get_all_stock_data() -> Dict[str, Dict[str, List[Dict]]]:
     获取所有板块的股票数据
     :return: 包含大A和港股数据的字典
     """
-    return {
-        'A': get_stock_data('SH.LIST0600'),
-        'HK': get_stock_data('HK.LIST1600')
-    }
+    # 两个板块互不依赖且均为网络 IO，并发请求以缩短总耗时；各自租用共享上下文
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        a_future = executor.submit(get_stock_data, 'SH.LIST0600')
+        hk_future = executor.submit(get_stock_data, 'HK.LIST1600')
+        return {
+            'A': a_future.result(),
+            'HK': hk_future.result()
+        }
 
 
 def extract_exchange_from_futu_code(futu_code: str) -> str:
@@ -519,6 +672,27 @@ def convert_to_futu_code(code: str, market: str = None, exchange: str = None) ->
         raise ValueError(f"必须提供 market 或 exchange 参数")
 
 
+def convert_to_futu_codes(codes: pd.Series, market: str = None, exchanges: pd.Series = None) -> pd.Series:
+    """
+    批量将股票代码转换为富途格式（convert_to_futu_code 的向量化版本）
+    :param codes: 股票代码序列，如 ['000001', '600519']
+    :param market: 市场类型，'A' 或 'HK'（如果未提供 exchanges 则必需）
+    :param exchanges: 与 codes 对齐的交易所代码序列（如果提供则优先使用）
+    :return: 富途格式的股票代码序列，如 ['SZ.000001', 'SH.600519']
+    """
+    codes = pd.Series(codes, dtype=object).astype(str)
+    if exchanges is not None:
+        return pd.Series(exchanges, index=codes.index, dtype=object).astype(str) + '.' + codes
+    elif market == 'A':
+        # A股：6开头或5开头是上海，其他是深圳
+        prefix = np.where(codes.str[:1].isin(['6', '5']), 'SH.', 'SZ.')
+        return prefix + codes
+    elif market == 'HK':
+        return 'HK.' + codes
+    else:
+        raise ValueError(f"必须提供 market 或 exchanges 参数")
+
+
 def get_plate_stocks(plate_code: str) -> List[Dict]:
     """
     获取板块内所有股票的基础信息
@@ -536,44 +710,42 @@ def get_plate_stocks(plate_code: str) -> List[Dict]:
         ]
     """
     try:
-        quote_ctx = get_quote_context()
-        
-        ret, data = quote_ctx.get_plate_stock(plate_code)
-        
-        if ret != RET_OK:
-            raise Exception(f"获取板块股票失败: {data}")
-        
-        if data.empty:
-            return []
-        
-        market = 'HK' if plate_code.startswith('HK.') else 'A'
-        
-        stocks = []
-        for _, row in data.iterrows():
-            futu_code = str(row['code']) if pd.notna(row['code']) else ''
-            stock_name = str(row['stock_name']) if pd.notna(row['stock_name']) else ''
-            
-            if '.' in futu_code:
-                exchange = futu_code.split('.')[0]
-                stock_code = futu_code.split('.')[1]
+        # TtlMemoryCache.get 返回深拷贝，调用方修改返回的列表不会影响缓存
+        cached = plate_stocks_cache.get(plate_code)
+        if cached is not None:
+            return cached
+
+        with quote_context_lease() as quote_ctx:
+            ret, data = quote_ctx.get_plate_stock(plate_code)
+
+            if ret != RET_OK:
+                raise Exception(f"获取板块股票失败: {data}")
+
+            if data.empty:
+                return []
+
+            market = 'HK' if plate_code.startswith('HK.') else 'A'
+
+            # 整列向量化拆分代码；交易所取值极少，转为分类类型后各行共享同一字符串对象
+            futu_codes = data['code'].fillna('').astype(str)
+            has_exchange = futu_codes.str.contains('.', regex=False)
+            split_codes = futu_codes.str.split('.')
+            if market == 'HK':
+                default_exchange = pd.Series('HK', index=futu_codes.index)
             else:
-                if market == 'HK':
-                    exchange = 'HK'
-                else:
-                    if futu_code.startswith(('6', '5')):
-                        exchange = 'SH'
-                    else:
-                        exchange = 'SZ'
-                stock_code = futu_code
-            
-            stocks.append({
-                'code': stock_code,
-                'name': stock_name,
-                'exchange': exchange,
+                default_exchange = pd.Series(
+                    np.where(futu_codes.str.startswith(('6', '5')), 'SH', 'SZ'),
+                    index=futu_codes.index
+                )
+            stocks = pd.DataFrame({
+                'code': split_codes.str[1].where(has_exchange, futu_codes),
+                'name': data['stock_name'].fillna('').astype(str),
+                'exchange': split_codes.str[0].where(has_exchange, default_exchange).astype('category'),
                 'market': market
-            })
-        
-        return stocks
+            }).to_dict('records')
+
+            plate_stocks_cache.set(plate_code, stocks, PLATE_STOCKS_TTL_SECONDS)
+            return stocks
         
     except Exception as e:
         raise Exception(f"获取板块股票失败: {str(e)}")
@@ -590,65 +762,93 @@ def get_all_stocks_basic_info() -> Dict[str, List[Dict]]:
         }
     """
     try:
-        # 获取A股所有股票
-        a_stocks = get_plate_stocks('SH.LIST3000005')
-        
-        # 获取港股所有股票
-        hk_stocks = get_plate_stocks('HK.LIST1910')
-        
-        return {
-            'A': a_stocks,
-            'HK': hk_stocks
-        }
+        # A股与港股成分股互不依赖，并发请求以缩短总耗时
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            a_future = executor.submit(get_plate_stocks, 'SH.LIST3000005')
+            hk_future = executor.submit(get_plate_stocks, 'HK.LIST1910')
+            return {
+                'A': a_future.result(),
+                'HK': hk_future.result()
+            }
     except Exception as e:
         raise Exception(f"获取所有股票基础信息失败: {str(e)}")
 
 
+# 条件选股被限频时的最大重试次数
+_STOCK_FILTER_MAX_RETRIES = 10
+# 条件选股单页数量，富途上限为 200
+_STOCK_FILTER_PAGE_SIZE = 200
+
+
+def _is_rate_limited(err_message) -> bool:
+    """
+    判断富途返回的错误信息是否为请求频率限制
+    """
+    message = str(err_message).lower()
+    return '频率' in message or 'frequen' in message
+
+
 def get_above_ma20_stock_codes() -> set:
     """
     获取A股市场（沪深）收盘价高于MA20的股票代码集合
     :return: set(['000001', ...])
     """
-    quote_ctx = get_quote_context()
-
-    custom_filter = CustomIndicatorFilter()
-    custom_filter.ktype = KLType.K_DAY
-    custom_filter.stock_field1 = StockField.PRICE
-    custom_filter.stock_field2 = StockField.MA
-    custom_filter.stock_field2_para = [20]
-    custom_filter.relative_position = RelativePosition.MORE
-    custom_filter.is_no_filter = False
-
-    def fetch_market_codes(market) -> set:
-        codes = set()
-        begin = 0
-        while True:
-            ret, ls = quote_ctx.get_stock_filter(
-                market=market,
-                filter_list=[custom_filter],
-                begin=begin
-            )
-            if ret != RET_OK:
-                raise Exception(ls)
+    cache_key = date.today().isoformat()
+    cached = above_ma20_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
-            time.sleep(3)
-            last_page, _, ret_list = ls
-            if not ret_list:
-                break
-            for item in ret_list:
-                raw_code = getattr(item, 'stock_code', '')
-                if '.' in raw_code:
-                    raw_code = raw_code.split('.')[1]
-                if raw_code:
-                    codes.add(raw_code)
-            if last_page:
-                break
-            begin += len(ret_list)
-        return codes
+    with quote_context_lease() as quote_ctx:
+        custom_filter = CustomIndicatorFilter()
+        custom_filter.ktype = KLType.K_DAY
+        custom_filter.stock_field1 = StockField.PRICE
+        custom_filter.stock_field2 = StockField.MA
+        custom_filter.stock_field2_para = [20]
+        custom_filter.relative_position = RelativePosition.MORE
+        custom_filter.is_no_filter = False
+
+        def fetch_market_codes(market) -> set:
+            codes = set()
+            begin = 0
+            while True:
+                # 不再固定每页休眠，只有被限频时才指数退避重试
+                backoff = 0.2
+                for _ in range(_STOCK_FILTER_MAX_RETRIES):
+                    stock_filter_rate_limiter.acquire()
+                    ret, ls = quote_ctx.get_stock_filter(
+                        market=market,
+                        filter_list=[custom_filter],
+                        begin=begin,
+                        num=_STOCK_FILTER_PAGE_SIZE
+                    )
+                    if ret == RET_OK or not _is_rate_limited(ls):
+                        break
+                    time.sleep(backoff)
+                    backoff = min(3.0, backoff * 2)
+                if ret != RET_OK:
+                    raise Exception(ls)
+
+                last_page, all_count, ret_list = ls
+                if not ret_list:
+                    break
+                codes.update(
+                    code.rpartition('.')[2]
+                    for code in (getattr(item, 'stock_code', '') for item in ret_list)
+                    if code
+                )
+                begin += len(ret_list)
+                # 已取满总数时无需再请求一页来确认 last_page
+                if last_page or begin >= all_count:
+                    break
+            return codes
 
-    sh_codes = fetch_market_codes(Market.SH)
-    sz_codes = fetch_market_codes(Market.SZ)
-    return sh_codes.union(sz_codes)
+        # 沪深两市分页互不依赖，并发拉取；频率由共享的条件选股限流器统一控制
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            sh_future = executor.submit(fetch_market_codes, Market.SH)
+            sz_future = executor.submit(fetch_market_codes, Market.SZ)
+            codes = sh_future.result().union(sz_future.result())
+    above_ma20_cache.set(cache_key, codes, ABOVE_MA20_TTL_SECONDS)
+    return codes
 
 
 def get_stock_current_price(code: str, market: str, exchange: str = None) -> Dict:
@@ -662,38 +862,42 @@ def get_stock_current_price(code: str, market: str, exchange: str = None) -> Dic
     """
     try:
         futu_code = convert_to_futu_code(code, market, exchange=exchange)
-        quote_ctx = get_quote_context()
-        
-        ret_sub, err_message = _subscribe_if_needed(quote_ctx, [futu_code], SubType.QUOTE)
-        if ret_sub != RET_OK:
-            raise Exception(f"订阅股票失败: {err_message}")
-        ret, data = quote_ctx.get_stock_quote([futu_code])
-        if ret != RET_OK:
-            raise Exception(f"获取股票报价失败: {data}")
-        
-        if data.empty:
-            raise Exception(f"未找到股票 {futu_code} 的报价数据")
-        
-        row = data.iloc[0]
-        last_price = float(row['last_price']) if pd.notna(row['last_price']) else None
-        prev_close_price = float(row['prev_close_price']) if pd.notna(row['prev_close_price']) else None
-        
-        change_ratio = None
-        if last_price is not None and prev_close_price is not None and prev_close_price > 0:
-            change_ratio = (last_price - prev_close_price) / prev_close_price * 100
-        
-        return {
-            'code': code,
-            'name': str(row['name']) if pd.notna(row['name']) else '',
-            'current_price': last_price,
-            'change_ratio': change_ratio,
-            'volume': int(row['volume']) if pd.notna(row['volume']) else 0,
-            'amount': float(row['turnover']) if pd.notna(row['turnover']) else 0,
-            'open_price': float(row['open_price']) if pd.notna(row['open_price']) else None,
-            'high_price': float(row['high_price']) if pd.notna(row['high_price']) else None,
-            'low_price': float(row['low_price']) if pd.notna(row['low_price']) else None,
-            'prev_close_price': prev_close_price
-        }
+        with quote_context_lease() as quote_ctx:
+            ret_sub, err_message = _subscribe_if_needed(quote_ctx, [futu_code], SubType.QUOTE)
+            if ret_sub != RET_OK:
+                raise Exception(f"订阅股票失败: {err_message}")
+            ret, data = quote_ctx.get_stock_quote([futu_code])
+            if ret != RET_OK:
+                raise Exception(f"获取股票报价失败: {data}")
+
+            if data.empty:
+                raise Exception(f"未找到股票 {futu_code} 的报价数据")
+
+            # 数值字段整行一次性转 float，缺失值统一置 None，避免逐字段 pd.notna
+            numbers = data.iloc[:1].reindex(columns=CURRENT_PRICE_COLUMNS).apply(
+                pd.to_numeric, errors='coerce'
+            ).astype(float)
+            values = numbers.astype(object).where(numbers.notna(), None).iloc[0]
+            last_price = values['last_price']
+            prev_close_price = values['prev_close_price']
+
+            change_ratio = None
+            if last_price is not None and prev_close_price is not None and prev_close_price > 0:
+                change_ratio = (last_price - prev_close_price) / prev_close_price * 100
+
+            name = data['name'].iloc[0] if 'name' in data.columns else None
+            return {
+                'code': code,
+                'name': str(name) if pd.notna(name) else '',
+                'current_price': last_price,
+                'change_ratio': change_ratio,
+                'volume': int(values['volume']) if values['volume'] is not None else 0,
+                'amount': values['turnover'] if values['turnover'] is not None else 0,
+                'open_price': values['open_price'],
+                'high_price': values['high_price'],
+                'low_price': values['low_price'],
+                'prev_close_price': prev_close_price
+            }
     except TimeoutError as e:
         logger.warning(f"获取股票 {code} 实时价格超时，使用降级数据: {e}")
         return _build_price_fallback(code)
@@ -711,43 +915,74 @@ def get_stock_rt_data(code: str, market: str) -> List[Dict]:
     """
     try:
         futu_code = convert_to_futu_code(code, market)
-        quote_ctx = get_quote_context()
-        
-        ret_sub, err_message = _subscribe_if_needed(quote_ctx, [futu_code], SubType.RT_DATA)
-        if ret_sub != RET_OK:
-            raise Exception(f"订阅分时数据失败: {err_message}")
-        ret, data = quote_ctx.get_rt_data(futu_code)
-        if ret != RET_OK:
-            raise Exception(f"获取分时数据失败: {data}")
-        
-        if data.empty:
-            return []
-        
-        result = []
-        for _, row in data.iterrows():
-            if bool(row.get('is_blank')):
-                continue
-            time_value = str(row.get('time', '')).strip()
-            cur_price = float(row['cur_price']) if pd.notna(row.get('cur_price')) else None
-            volume = int(row['volume']) if pd.notna(row.get('volume')) else 0
-            last_close = float(row['last_close']) if pd.notna(row.get('last_close')) else None
-            turnover = float(row['turnover']) if pd.notna(row.get('turnover')) else None
-            result.append({
-                'date': time_value,
+        with quote_context_lease() as quote_ctx:
+            ret_sub, err_message = _subscribe_if_needed(quote_ctx, [futu_code], SubType.RT_DATA)
+            if ret_sub != RET_OK:
+                raise Exception(f"订阅分时数据失败: {err_message}")
+            ret, data = quote_ctx.get_rt_data(futu_code)
+            if ret != RET_OK:
+                raise Exception(f"获取分时数据失败: {data}")
+
+            if data.empty:
+                return []
+
+            # 整表过滤空白分时并统一转换类型，避免逐行 iterrows
+            if 'is_blank' in data.columns:
+                data = data[~data['is_blank'].astype(bool)]
+            df = data.reindex(columns=['time', 'cur_price', 'volume', 'last_close', 'turnover'])
+            numbers = df[['cur_price', 'last_close', 'turnover']].apply(pd.to_numeric, errors='coerce').astype(float)
+            numbers = numbers.astype(object).where(numbers.notna(), None)
+            cur_price = numbers['cur_price']
+            result = pd.DataFrame({
+                'date': df['time'].fillna('').astype(str).str.strip(),
                 'open': cur_price,
                 'close': cur_price,
                 'high': cur_price,
                 'low': cur_price,
-                'volume': volume,
-                'last_close': last_close,
-                'turnover': turnover
-            })
-        
-        return result
+                'volume': pd.to_numeric(df['volume'], errors='coerce').fillna(0).astype(int),
+                'last_close': numbers['last_close'],
+                'turnover': numbers['turnover']
+            }).to_dict('records')
+
+            return result
     except Exception as e:
         raise Exception(f"获取分时数据失败: {str(e)}")
 
 
+# 日K长区间按时间窗并发拉取：单窗口天数与并发数
+_KLINE_WINDOW_DAYS = 183
+_KLINE_WINDOW_WORKERS = 4
+
+
+def _split_kline_windows(start: str, end: str, ktype: str, max_count: int) -> List[Tuple[str, str, int]]:
+    """
+    将日K请求区间切分为互不重叠的时间窗 (start, end, max_count)
+    只有 max_count 不小于区间自然日数（即结果不会被 max_count 截断）时才切分，保证与顺序翻页结果一致
+    """
+    if ktype != "K_DAY":
+        return [(start, end, max_count)]
+    try:
+        start_date = datetime.strptime(start, '%Y-%m-%d').date()
+        end_date = datetime.strptime(end, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return [(start, end, max_count)]
+    total_days = (end_date - start_date).days + 1
+    if total_days <= _KLINE_WINDOW_DAYS or max_count < total_days:
+        return [(start, end, max_count)]
+
+    windows = []
+    window_start = start_date
+    while window_start <= end_date:
+        window_end = min(end_date, window_start + timedelta(days=_KLINE_WINDOW_DAYS - 1))
+        windows.append((
+            window_start.strftime('%Y-%m-%d'),
+            window_end.strftime('%Y-%m-%d'),
+            (window_end - window_start).days + 1
+        ))
+        window_start = window_end + timedelta(days=1)
+    return windows
+
+
 def get_stock_history_kline(code: str, market: str, start: str, end: str, max_count: int = 1000, ktype: str = "K_DAY", exchange: str = None) -> List[Dict]:
     """
     获取指定股票的历史K线数据（默认日K）
@@ -775,53 +1010,58 @@ def get_stock_history_kline(code: str, market: str, start: str, end: str, max_co
         if ktype == "K_RT":
             return get_stock_rt_data(code, market)
         futu_code = convert_to_futu_code(code, market, exchange=exchange)
-        quote_ctx = get_quote_context()
-        
-        result = []
-        page_req_key = None
-        remaining = max_count
-        
-        ktype_mapping = {
-            "K_DAY": KLType.K_DAY,
-            "K_WEEK": KLType.K_WEEK,
-            "K_MON": KLType.K_MON,
-            "K_QUARTER": KLType.K_QUARTER,
-            "K_YEAR": KLType.K_YEAR
-        }
-        ktype_value = ktype_mapping.get(ktype, KLType.K_DAY)
-        
-        while remaining > 0:
-            ret, data, page_req_key = quote_ctx.request_history_kline(
-                code=futu_code,
-                start=start,
-                end=end,
-                max_count=remaining,
-                ktype=ktype_value,
-                page_req_key=page_req_key
-            )
-            
-            if ret != RET_OK:
-                raise Exception(f"获取K线数据失败: {data}")
-            
-            if data.empty:
-                break
-            
-            for _, row in data.iterrows():
-                time_key = str(row.get('time_key', '')).split(' ')[0]
-                result.append({
-                    'date': time_key,
-                    'open': float(row['open']) if pd.notna(row['open']) else None,
-                    'close': float(row['close']) if pd.notna(row['close']) else None,
-                    'high': float(row['high']) if pd.notna(row['high']) else None,
-                    'low': float(row['low']) if pd.notna(row['low']) else None,
-                    'volume': int(row['volume']) if pd.notna(row['volume']) else 0
-                })
-            
-            remaining = max_count - len(result)
-            if not page_req_key:
-                break
-        
-        return result
+        ktype_value = _KTYPE_MAPPING.get(ktype, KLType.K_DAY)
+        with quote_context_lease() as quote_ctx:
+            def fetch_range(range_start: str, range_end: str, range_max_count: int) -> List[pd.DataFrame]:
+                frames: List[pd.DataFrame] = []
+                fetched = 0
+                page_req_key = None
+                remaining = range_max_count
+                while remaining > 0:
+                    history_kline_rate_limiter.acquire()
+                    ret, data, page_req_key = quote_ctx.request_history_kline(
+                        code=futu_code,
+                        start=range_start,
+                        end=range_end,
+                        max_count=remaining,
+                        ktype=ktype_value,
+                        page_req_key=page_req_key
+                    )
+
+                    if ret != RET_OK:
+                        raise Exception(f"获取K线数据失败: {data}")
+
+                    if data.empty:
+                        break
+
+                    # 各页只保留所需列，翻页结束后统一转换
+                    frames.append(data[['time_key', 'open', 'close', 'high', 'low', 'volume']])
+                    fetched += len(data)
+                    remaining = range_max_count - fetched
+                    if not page_req_key:
+                        break
+                return frames
+
+            windows = _split_kline_windows(start, end, ktype, max_count)
+            if len(windows) > 1:
+                # 长区间日K按时间窗并发拉取，各窗口内仍顺序翻页
+                with ThreadPoolExecutor(max_workers=min(_KLINE_WINDOW_WORKERS, len(windows))) as executor:
+                    window_frames = list(executor.map(lambda window: fetch_range(*window), windows))
+                frames = [frame for part in window_frames for frame in part]
+            else:
+                frames = fetch_range(start, end, max_count)
+
+            if not frames:
+                return []
+
+            df = pd.concat(frames, ignore_index=True)
+            if len(windows) > 1:
+                df = df.drop_duplicates(subset='time_key').head(max_count)
+            prices = df[['open', 'close', 'high', 'low']].apply(pd.to_numeric, errors='coerce').astype(float)
+            result = prices.astype(object).where(prices.notna(), None)
+            result.insert(0, 'date', df['time_key'].astype(str).str.split(' ').str[0])
+            result['volume'] = pd.to_numeric(df['volume'], errors='coerce').fillna(0).astype(int)
+            return result.to_dict('records')
     except Exception as e:
         raise Exception(f"获取K线历史数据失败: {str(e)}")
 
@@ -928,8 +1168,9 @@ def get_stock_holding_pain_metrics(
     market: str,
     exchange: str = None,
 ) -> Optional[Dict]:
-    end = datetime.now().strftime('%Y-%m-%d')
-    start = (datetime.now() - timedelta(days=HOLDING_PAIN_LOOKBACK_DAYS)).strftime('%Y-%m-%d')
+    now = datetime.now()
+    end = now.strftime('%Y-%m-%d')
+    start = (now - timedelta(days=HOLDING_PAIN_LOOKBACK_DAYS)).strftime('%Y-%m-%d')
     bars = get_stock_history_kline(code, market, start, end, max_count=200, exchange=exchange)
     return calculate_holding_pain_index(bars)
 
@@ -1020,9 +1261,7 @@ def get_market_leader_list(db, trading_date_utils, limit_per_market: int = 8) ->
     end_date = (now - timedelta(days=1)).strftime('%Y-%m-%d') if before_open else now.strftime('%Y-%m-%d')
     start_date = (now - timedelta(days=60)).strftime('%Y-%m-%d')
 
-    cn_days = set(trading_date_utils.get_trading_days_in_range(start_date, end_date, market="CN"))
-    hk_days = set(trading_date_utils.get_trading_days_in_range(start_date, end_date, market="HK"))
-    all_days = sorted(cn_days | hk_days, reverse=True)
+    all_days = trading_date_utils.get_trading_days_union(start_date, end_date, markets=("CN", "HK"))[::-1]
 
     result = {
         'date': None,
@@ -1065,9 +1304,7 @@ def get_market_leader_insights(db, trading_date_utils, limit_per_market: int = 8
     end_date = (now - timedelta(days=1)).strftime('%Y-%m-%d') if before_open else now.strftime('%Y-%m-%d')
     start_date = (now - timedelta(days=60)).strftime('%Y-%m-%d')
 
-    cn_days = set(trading_date_utils.get_trading_days_in_range(start_date, end_date, market="CN"))
-    hk_days = set(trading_date_utils.get_trading_days_in_range(start_date, end_date, market="HK"))
-    all_days = sorted(cn_days | hk_days, reverse=True)
+    all_days = trading_date_utils.get_trading_days_union(start_date, end_date, markets=("CN", "HK"))[::-1]
 
     result = {
         'date': None,
@@ -1956,8 +2193,8 @@ def _log_opend_environment(quote_ctx, futu_code: str) -> Optional[str]:
             futu_code,
             server_ver,
             getattr(futu_pkg, '__version__', 'unknown'),
-            os.getenv('FUTU_HOST', '127.0.0.1'),
-            os.getenv('FUTU_PORT', '11111'),
+            _FUTU_HOST,
+            _FUTU_PORT,
         )
     except Exception as exc:
         logger.warning('[估值数据][%s] 读取 OpenD 环境失败: %s', futu_code, exc)
@@ -2583,82 +2820,82 @@ def get_stock_valuation_metrics(code: str, market: str) -> Dict:
     - TTM：PE = pe_ttm_ratio；PEG/回收期配扣非 TTM 同比
     """
     futu_code = convert_to_futu_code(code, market)
-    quote_ctx = get_quote_context()
-    opend_server_ver = _log_opend_environment(quote_ctx, futu_code)
-
-    ret, snap_df = quote_ctx.get_market_snapshot([futu_code])
-    if ret != RET_OK:
-        raise Exception(f"获取市场快照失败: {snap_df}")
-    if snap_df.empty:
-        raise Exception(f"未找到股票 {futu_code} 的快照数据")
-
-    row = snap_df.iloc[0]
-    market_cap = _metric_float(row.get('total_market_val'))
-    pe_static = _metric_float(row.get('pe_ratio'))
-    pe_ttm = _metric_float(row.get('pe_ttm_ratio'))
-    current_price = _metric_float(row.get('last_price'))
-    shares = _metric_float(row.get('issued_shares'))
-    if shares is None or shares <= 0:
-        shares = _metric_float(row.get('outstanding_shares'))
+    with quote_context_lease() as quote_ctx:
+        opend_server_ver = _log_opend_environment(quote_ctx, futu_code)
 
-    logger.info(
-        '[估值数据][%s] 快照 code=%s market=%s price=%s market_cap_yi=%s '
-        'pe_static=%s pe_ttm=%s shares=%s',
-        futu_code,
-        code,
-        market,
-        current_price,
-        _format_yi_for_log(market_cap),
-        pe_static,
-        pe_ttm,
-        shares,
-    )
+        ret, snap_df = quote_ctx.get_market_snapshot([futu_code])
+        if ret != RET_OK:
+            raise Exception(f"获取市场快照失败: {snap_df}")
+        if snap_df.empty:
+            raise Exception(f"未找到股票 {futu_code} 的快照数据")
+
+        row = snap_df.iloc[0]
+        market_cap = _metric_float(row.get('total_market_val'))
+        pe_static = _metric_float(row.get('pe_ratio'))
+        pe_ttm = _metric_float(row.get('pe_ttm_ratio'))
+        current_price = _metric_float(row.get('last_price'))
+        shares = _metric_float(row.get('issued_shares'))
+        if shares is None or shares <= 0:
+            shares = _metric_float(row.get('outstanding_shares'))
 
-    metrics: Dict = {
-        'code': code,
-        'name': str(row.get('name', '')) if pd.notna(row.get('name')) else '',
-        'market': market,
-        'currency': 'HKD' if market == 'HK' else 'CNY',
-        'current_price': current_price,
-        'market_cap': market_cap,
-        'pe_static': pe_static,
-        'pe_ttm': pe_ttm,
-        'opend_server_ver': opend_server_ver,
-        'data_sources': ['market_snapshot', 'financial_statements_income', 'financial_statements_main_index'],
-    }
+        logger.info(
+            '[估值数据][%s] 快照 code=%s market=%s price=%s market_cap_yi=%s '
+            'pe_static=%s pe_ttm=%s shares=%s',
+            futu_code,
+            code,
+            market,
+            current_price,
+            _format_yi_for_log(market_cap),
+            pe_static,
+            pe_ttm,
+            shares,
+        )
 
-    if market_cap is not None:
-        metrics['market_cap_yi'] = market_cap / 1e8
+        metrics: Dict = {
+            'code': code,
+            'name': str(row.get('name', '')) if pd.notna(row.get('name')) else '',
+            'market': market,
+            'currency': 'HKD' if market == 'HK' else 'CNY',
+            'current_price': current_price,
+            'market_cap': market_cap,
+            'pe_static': pe_static,
+            'pe_ttm': pe_ttm,
+            'opend_server_ver': opend_server_ver,
+            'data_sources': ['market_snapshot', 'financial_statements_income', 'financial_statements_main_index'],
+        }
 
-    scenarios, series_error = _build_valuation_scenarios(
-        quote_ctx,
-        futu_code,
-        market,
-        market_cap=market_cap,
-        current_price=current_price,
-        shares=shares,
-        pe_static=pe_static,
-        pe_ttm=pe_ttm,
-    )
-    metrics['scenarios'] = scenarios
-    if series_error:
-        metrics['profit_growth_error'] = series_error
-    logger.info(
-        '[估值数据][%s] 结果 dynamic_errors=%s ttm_errors=%s series_error=%r',
-        futu_code,
-        scenarios.get('dynamic', {}).get('errors'),
-        scenarios.get('ttm', {}).get('errors'),
-        series_error,
-    )
-    if series_error and not metrics.get('opend_server_ver'):
-        try:
-            ret, global_state = quote_ctx.get_global_state()
-            if ret == RET_OK and isinstance(global_state, dict):
-                metrics['opend_server_ver'] = global_state.get('server_ver')
-        except Exception:
-            pass
+        if market_cap is not None:
+            metrics['market_cap_yi'] = market_cap / 1e8
+
+        scenarios, series_error = _build_valuation_scenarios(
+            quote_ctx,
+            futu_code,
+            market,
+            market_cap=market_cap,
+            current_price=current_price,
+            shares=shares,
+            pe_static=pe_static,
+            pe_ttm=pe_ttm,
+        )
+        metrics['scenarios'] = scenarios
+        if series_error:
+            metrics['profit_growth_error'] = series_error
+        logger.info(
+            '[估值数据][%s] 结果 dynamic_errors=%s ttm_errors=%s series_error=%r',
+            futu_code,
+            scenarios.get('dynamic', {}).get('errors'),
+            scenarios.get('ttm', {}).get('errors'),
+            series_error,
+        )
+        if series_error and not metrics.get('opend_server_ver'):
+            try:
+                ret, global_state = quote_ctx.get_global_state()
+                if ret == RET_OK and isinstance(global_state, dict):
+                    metrics['opend_server_ver'] = global_state.get('server_ver')
+            except Exception:
+                pass
 
-    return metrics
+        return metrics
 
 
 if __name__ == '__main__':
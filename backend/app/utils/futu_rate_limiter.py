@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-"""富途 OpenD 财报接口频率限制（每 30 秒最多 30 次）。"""
+"""富途 OpenD 接口频率限制：财报接口每 30 秒最多 30 次，条件选股每 30 秒最多 10 次，历史K线每 30 秒最多 60 次。"""
 
 import threading
 import time
@@ -30,3 +30,5 @@ class FinancialApiRateLimiter:
 
 
 financial_api_rate_limiter = FinancialApiRateLimiter(max_calls=30, period_seconds=30.0)
+stock_filter_rate_limiter = FinancialApiRateLimiter(max_calls=10, period_seconds=30.0)
+history_kline_rate_limiter = FinancialApiRateLimiter(max_calls=60, period_seconds=30.0)
@@ -1,7 +1,11 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Any
 
+import numpy as np
+import pandas as pd
+
 from app.db.database import db
 from app.utils.futu_data import get_above_ma20_stock_codes, get_plate_stocks
 from app.utils.sector_classifier import SECTOR_DEFINITIONS, SECTOR_INDUSTRY_MAP, INDEX_CODES
@@ -14,177 +18,165 @@ INDEX_LABELS = {
 }
 
 
-def _normalize_index_membership(value) -> List[str]:
-    if value is None:
-        return []
-    if isinstance(value, list):
-        return value
-    if isinstance(value, str):
-        return [value]
-    return []
-
-
-def _compute_index_breadth(index_code: str, above_ma20_codes: set):
+def _compute_index_breadth(index_code: str, above_ma20_codes: frozenset, now: datetime):
     """
-    计算单个指数的整体MA20市场宽度，并写入数据库
+    计算单个指数的整体MA20市场宽度，返回待写入的记录
     """
-    index_members_list = [
-        stock for stock in get_plate_stocks(index_code)
-        if stock.get('market') == 'A'
-    ]
-    if not index_members_list:
-        return
-    index_member_codes = [
-        stock.get("code") for stock in index_members_list if stock.get("code")
-    ]
+    # 成分股去重后再计数，保证 total 与 above 基于同一集合
+    index_member_codes = {
+        code for stock in get_plate_stocks(index_code)
+        if stock.get('market') == 'A' and (code := stock.get("code"))
+    }
     if not index_member_codes:
-        return
+        return []
 
     total_count = len(index_member_codes)
-    above_count = sum(1 for code in index_member_codes if code in above_ma20_codes)
-    breadth_pct = 0 if total_count == 0 else round(above_count / total_count * 100, 2)
-
-    current_date = datetime.now().strftime('%Y-%m-%d')
+    above_count = len(above_ma20_codes & index_member_codes)
     label = INDEX_LABELS.get(index_code, index_code)
-    records = [{
-        "date": current_date,
-        "breadth_type": "index",
-        "sector": label,
-        "total_count": total_count,
-        "above_ma20_count": above_count,
+    counts = pd.DataFrame({'total': [total_count], 'above': [above_count]}, index=[label])
+    return _build_breadth_records("index", counts, now)
+
+
+def _build_breadth_records(breadth_type: str, counts: pd.DataFrame, now: datetime) -> List[Dict[str, Any]]:
+    """
+    将按分类聚合的 total/above 计数转换为市场宽度记录
+    :param breadth_type: 宽度类型，'index'、'sector' 或 'industry'
+    :param counts: 以分类名为索引、含 total 与 above 两列的计数表
+    :param now: 本次计算的统一时间，决定记录日期与 updated_at
+    """
+    total = counts['total'].to_numpy(dtype=np.int64)
+    above = counts['above'].to_numpy(dtype=np.int64)
+    # 整列计算占比，total 为 0 的分类占比记为 0
+    breadth_pct = np.where(total > 0, np.round(above / np.maximum(total, 1) * 100, 2), 0.0)
+    return pd.DataFrame({
+        "date": now.strftime('%Y-%m-%d'),
+        "breadth_type": breadth_type,
+        "sector": counts.index,
+        "total_count": total,
+        "above_ma20_count": above,
         "breadth_pct": breadth_pct,
-        "updated_at": datetime.now().isoformat()
-    }]
+        "updated_at": now.isoformat()
+    }).to_dict('records')
 
-    db.upsert_market_breadth(records)
 
+def _count_above_ma20(stocks: pd.DataFrame, group_column: str, groups: List[str], above_ma20_codes: frozenset) -> pd.DataFrame:
+    """
+    按分类整列统计成分数与站上 MA20 的数量，未出现的分类补 0
+    分类编码为整数后用 bincount 一次计数，省去 groupby 的分组开销
+    """
+    group_ids = pd.Categorical(stocks[group_column], categories=groups).codes
+    valid = group_ids >= 0
+    group_ids = group_ids[valid]
+    above = stocks['stock_code'].isin(above_ma20_codes).to_numpy()[valid]
+    return pd.DataFrame({
+        'total': np.bincount(group_ids, minlength=len(groups)),
+        'above': np.bincount(group_ids, weights=above, minlength=len(groups)).astype(np.int64)
+    }, index=groups)
 
-def _compute_sector_breadth_all_a(above_ma20_codes: set):
+
+def _compute_sector_breadth_all_a(stocks: List[Dict], above_ma20_codes: frozenset, now: datetime):
     """
     使用全A股股票计算各一级分类的MA20市场宽度
+    :param stocks: 全A股基础信息（stock_code, sector, industry）
     """
-    stocks = db.get_stock_basic_info_paginated(
-        market='A',
-        columns='stock_code,sector,industry'
-    )
     if not stocks:
-        return
+        return []
 
-    sector_stats: Dict[str, Dict[str, int]] = {
-        sector: {"total": 0, "above": 0} for sector in SECTOR_DEFINITIONS.keys()
-    }
+    stock_df = pd.DataFrame(stocks, columns=['stock_code', 'sector'])
+    sectors = list(SECTOR_DEFINITIONS.keys())
+    valid = stock_df['sector'].isin(sectors)
+    for stock_code in stock_df.loc[~valid, 'stock_code']:
+        logging.warning(f"{stock_code} 未分类")
 
-    for stock in stocks:
-        sector = stock.get("sector")
-        if sector not in sector_stats:
-            logging.warning(f"{stock.get('stock_code')} 未分类")
-            continue
-        sector_stats[sector]["total"] += 1
-        if stock.get("stock_code") in above_ma20_codes:
-            sector_stats[sector]["above"] += 1
-
-    current_date = datetime.now().strftime('%Y-%m-%d')
-    records = []
-    for sector, stats in sector_stats.items():
-        total = stats["total"]
-        above = stats["above"]
-        if total == 0:
-            breadth_pct = 0
-        else:
-            breadth_pct = round(above / total * 100, 2)
-        records.append({
-            "date": current_date,
-            "breadth_type": "sector",
-            "sector": sector,
-            "total_count": total,
-            "above_ma20_count": above,
-            "breadth_pct": breadth_pct,
-            "updated_at": datetime.now().isoformat()
-        })
+    counts = _count_above_ma20(stock_df[valid], 'sector', sectors, above_ma20_codes)
+    return _build_breadth_records("sector", counts, now)
 
-    db.upsert_market_breadth(records)
 
-
-def _compute_industry_breadth_all_a(above_ma20_codes: set):
+def _compute_industry_breadth_all_a(stocks: List[Dict], above_ma20_codes: frozenset, now: datetime):
     """
     使用全A股股票计算各二级行业的MA20市场宽度
+    :param stocks: 全A股基础信息（stock_code, sector, industry）
     """
-    stocks = db.get_stock_basic_info_paginated(
-        market='A',
-        columns='stock_code,sector,industry'
-    )
     if not stocks:
-        return
+        return []
 
-    industry_stats: Dict[str, Dict[str, int]] = {
-        industry: {"total": 0, "above": 0}
-        for industries in SECTOR_INDUSTRY_MAP.values()
+    stock_df = pd.DataFrame(stocks, columns=['stock_code', 'sector', 'industry'])
+    stock_df = stock_df[stock_df['stock_code'].notna() & (stock_df['stock_code'] != '')]
+    valid_pairs = pd.MultiIndex.from_tuples([
+        (sector, industry)
+        for sector, industries in SECTOR_INDUSTRY_MAP.items()
         for industry in industries
-    }
-
-    for stock in stocks:
-        stock_code = stock.get("stock_code")
-        sector = stock.get("sector")
-        industry = stock.get("industry")
-        if not stock_code:
-            continue
-        if sector not in SECTOR_INDUSTRY_MAP:
+    ])
+    valid_sector = stock_df['sector'].isin(list(SECTOR_INDUSTRY_MAP.keys()))
+    valid = valid_sector & pd.MultiIndex.from_frame(stock_df[['sector', 'industry']]).isin(valid_pairs)
+    for stock_code, sector, industry, sector_ok in stock_df.loc[~valid].assign(
+        sector_ok=valid_sector[~valid]
+    ).itertuples(index=False, name=None):
+        if not sector_ok:
             logging.warning(f"{stock_code} 一级分类缺失或无效: {sector}")
-            continue
-        if industry not in SECTOR_INDUSTRY_MAP[sector]:
-            logging.warning(f"{stock_code} 二级行业缺失或无效: {industry}")
-            continue
-        industry_stats[industry]["total"] += 1
-        if stock_code in above_ma20_codes:
-            industry_stats[industry]["above"] += 1
-
-    current_date = datetime.now().strftime('%Y-%m-%d')
-    records = []
-    for industry, stats in industry_stats.items():
-        total = stats["total"]
-        above = stats["above"]
-        if total == 0:
-            breadth_pct = 0
         else:
-            breadth_pct = round(above / total * 100, 2)
-        records.append({
-            "date": current_date,
-            "breadth_type": "industry",
-            "sector": industry,
-            "total_count": total,
-            "above_ma20_count": above,
-            "breadth_pct": breadth_pct,
-            "updated_at": datetime.now().isoformat()
-        })
+            logging.warning(f"{stock_code} 二级行业缺失或无效: {industry}")
 
-    db.upsert_market_breadth(records)
+    industries = list(dict.fromkeys(
+        industry for industries in SECTOR_INDUSTRY_MAP.values() for industry in industries
+    ))
+    counts = _count_above_ma20(stock_df[valid], 'industry', industries, above_ma20_codes)
+    return _build_breadth_records("industry", counts, now)
 
 
 def compute_market_breadth_daily(index_codes: List[str] = None):
     """
     计算指数宽度 + 一级分类宽度 + 二级行业宽度，并写入数据库
     """
-    if not is_trading_day(datetime.now()):
+    # 本次计算的所有记录共用同一时间戳
+    now = datetime.now()
+    if not is_trading_day(now):
         # 非交易时间，直接返回
         return
 
     if index_codes is None:
         index_codes = INDEX_CODES
-    above_ma20_codes = set(get_above_ma20_stock_codes())
-    for index_code in index_codes:
+    # 只读且在各线程间共享，用 frozenset 固定下来
+    above_ma20_codes = frozenset(get_above_ma20_stock_codes())
+    # 各部分记录先在内存汇总，最后一次性 upsert，减少数据库往返
+    records: List[Dict[str, Any]] = []
+    def compute_index(index_code: str) -> List[Dict[str, Any]]:
         try:
-            _compute_index_breadth(index_code, above_ma20_codes)
+            return _compute_index_breadth(index_code, above_ma20_codes, now)
         except Exception as exc:
             logging.error(f"❌ 计算市场宽度失败: {index_code} - {exc}")
-            continue
+            return []
+
+    # 各指数成分股请求互不依赖，并发拉取；同一指数只计算一次
+    unique_index_codes = list(dict.fromkeys(index_codes))
+    if unique_index_codes:
+        with ThreadPoolExecutor(max_workers=len(unique_index_codes)) as executor:
+            for index_records in executor.map(compute_index, unique_index_codes):
+                records.extend(index_records)
+
+    # 一级分类与二级行业共用同一份全A股基础信息，只分页查询一次
+    stocks = []
     try:
-        _compute_sector_breadth_all_a(above_ma20_codes)
+        stocks = db.get_stock_basic_info_paginated(
+            market='A',
+            columns='stock_code,sector,industry'
+        )
     except Exception as exc:
-        logging.error(f"❌ 计算一级分类宽度失败: {exc}")
+        logging.error(f"❌ 获取全A股基础信息失败: {exc}")
+    if stocks:
+        try:
+            records.extend(_compute_sector_breadth_all_a(stocks, above_ma20_codes, now))
+        except Exception as exc:
+            logging.error(f"❌ 计算一级分类宽度失败: {exc}")
+        try:
+            records.extend(_compute_industry_breadth_all_a(stocks, above_ma20_codes, now))
+        except Exception as exc:
+            logging.error(f"❌ 计算二级行业宽度失败: {exc}")
+
     try:
-        _compute_industry_breadth_all_a(above_ma20_codes)
+        db.upsert_market_breadth(records)
     except Exception as exc:
-        logging.error(f"❌ 计算二级行业宽度失败: {exc}")
+        logging.error(f"❌ 写入市场宽度失败: {exc}")
 
 
 __all__ = ["compute_market_breadth_daily"]
@@ -1,16 +1,27 @@
+import hashlib
 import json
+import logging
 import os
+import random
 import re
+import threading
+import time
 import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+from functools import lru_cache
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
 from xml.etree import ElementTree as ET
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from app.db.database import db
 from app.utils.futu_data import get_plate_stocks
 
+logger = logging.getLogger(__name__)
+
 SECTOR_INDUSTRY_MAP: Dict[str, List[str]] = {
     "科技": ["半导体", "消费电子", "光学光电子", "通信设备", "IT服务", "软件开发", "计算机设备", "自动化设备", "其他电子", "元件", "文化传媒", "影视院线", "游戏", "通信服务", "通用设备", "专用设备", "电机", "工程机械", "轨交设备"],
     "医药": ["化学制药", "生物制品", "中药", "医疗器械", "医疗服务", "医药商业"],
@@ -31,6 +42,11 @@ INDUSTRY_TO_SECTOR = {
     for sector, industries in SECTOR_INDUSTRY_MAP.items()
     for industry in industries
 }
+# 热路径上的成员判断使用预先构建的集合，避免逐次创建临时 set
+_SECTOR_KEYS = frozenset(SECTOR_DEFINITIONS)
+_SECTOR_INDUSTRY_SETS: Dict[str, frozenset] = {
+    sector: frozenset(industries) for sector, industries in SECTOR_INDUSTRY_MAP.items()
+}
 
 INDEX_CODE_ZZ800 = 'SH.000906'
 INDEX_CODES = [
@@ -40,49 +56,67 @@ INDEX_CODES = [
     'SH.000016'   # 上证50指数
 ]
 SECTOR_INDUSTRY_EXCEL_ENV = "SECTOR_INDUSTRY_EXCEL_PATH"
+DEEPSEEK_CONCURRENCY_ENV = "DEEPSEEK_CONCURRENCY"
+_DEFAULT_DEEPSEEK_CONCURRENCY = 8
+# 按输出 token 预算限制单批股票数：输出越长解码越慢，小批次并发请求整体更快
+_MAX_OUTPUT_TOKENS_PER_BATCH = 400
+_EST_OUTPUT_TOKENS_PER_STOCK = 20
 _XLSX_NS = {'a': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+_XLSX_SHEET_DATA_TAG = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}sheetData'
+_XLSX_ROW_TAG = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}row'
+_XLSX_SI_TAG = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}si'
+_XLSX_T_TAG = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}t'
 
 
 class DeepSeekContentRiskError(Exception):
     pass
 
 
+# 复用 HTTPS 连接，并发批次之间免去重复的 TCP/TLS 握手
+_deepseek_session = requests.Session()
+_deepseek_session.mount("https://", HTTPAdapter(pool_maxsize=32))
+
+
+_STOCK_CODE_DIGITS_RE = re.compile(r'(\d{6})')
+
+
 def _normalize_stock_code(stock_code: Optional[str]) -> str:
     if stock_code is None:
         return ""
     raw = str(stock_code).strip().upper()
     if not raw:
         return ""
+    # 最常见的是已规范的 6 位纯数字代码，直接返回
+    if len(raw) == 6 and raw.isascii() and raw.isdigit():
+        return raw
     # 兼容 000001、000001.SZ、SZ000001、600000.0 等格式
-    digit_match = re.search(r'(\d{6})', raw)
+    digit_match = _STOCK_CODE_DIGITS_RE.search(raw)
     if digit_match:
         return digit_match.group(1)
     raw = raw.replace(".0", "")
     return raw.zfill(6) if raw.isdigit() and len(raw) <= 6 else ""
 
 
+_STOCK_NAME_STRIP_TABLE = str.maketrans("", "", "*★")
+
+
 def _sanitize_stock_name(name: str) -> str:
     if not name:
         return ""
-    cleaned = str(name).replace("*", "").replace("★", "").strip()
+    cleaned = str(name).translate(_STOCK_NAME_STRIP_TABLE).strip()
     return " ".join(cleaned.split())
 
 
-def _build_sector_prompt(stock_items: List[Dict]) -> str:
-    sector_list = "、".join(SECTOR_DEFINITIONS.keys())
-    definitions = "\n".join([f"- {k}: {v}" for k, v in SECTOR_DEFINITIONS.items()])
-    stock_lines = "\n".join([
-        f"- {item['stock_code']} {_sanitize_stock_name(item['stock_name'])}"
-        for item in stock_items
-    ])
-
-    return f"""你是资深A股行业研究员，请根据股票名称和常识判断一级分类和二级行业。
+_SECTOR_LIST_TEXT = "、".join(SECTOR_DEFINITIONS.keys())
+_SECTOR_DEFINITIONS_TEXT = "\n".join(f"- {k}: {v}" for k, v in SECTOR_DEFINITIONS.items())
+# 分类说明对所有批次相同，放在 system 消息中，便于服务端按相同前缀命中提示词缓存
+_SECTOR_SYSTEM_PROMPT = f"""你是资深A股行业研究员，请根据股票名称和常识判断一级分类和二级行业。
 
 一级分类候选（只能从以下10个中选择）：
-{sector_list}
+{_SECTOR_LIST_TEXT}
 
 二级行业范围：
-{definitions}
+{_SECTOR_DEFINITIONS_TEXT}
 
 请输出严格JSON对象，格式如下：
 {{"items":[{{"stock_code":"000001","sector":"金融","industry":"银行","confidence":85}}]}}
@@ -95,13 +129,103 @@ stock_code, sector, industry, confidence
 1. sector 必须是上述10个一级分类之一。
 2. industry 必须是对应 sector 下的二级行业之一。
 3. 若信息不足，返回 sector="未分类"、industry="未分类"。
-
-股票列表：
-{stock_lines}
 """
 
 
-def _call_deepseek(prompt: str) -> List[Dict]:
+def _build_sector_prompt(stock_items: List[Dict]) -> str:
+    stock_lines = "\n".join(
+        f"- {item['stock_code']} {_sanitize_stock_name(item['stock_name'])}"
+        for item in stock_items
+    )
+    return "股票列表：\n" + stock_lines + "\n"
+
+
+_DEEPSEEK_MAX_ATTEMPTS = 4
+_DEEPSEEK_RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+_DEEPSEEK_MAX_BACKOFF_SEC = 30.0
+# (连接超时, 读取超时)：连接失败快速重试，读取留足模型生成时间
+_DEEPSEEK_TIMEOUT = (5, 60)
+
+# 可选的 Redis 响应缓存：仅在配置 REDIS_URL 时启用，跨进程复用相同提示词的分类结果
+REDIS_URL_ENV = "REDIS_URL"
+_DEEPSEEK_CACHE_KEY_PREFIX = "deepseek:v1:"
+_DEEPSEEK_CACHE_TTL_SECONDS = 7 * 86400
+_redis_client = None
+_redis_client_loaded = False
+_redis_client_lock = threading.Lock()
+
+
+def _post_deepseek(url: str, headers: Dict, payload: Dict) -> requests.Response:
+    """
+    发送 DeepSeek 请求；超时、连接异常及 429/5xx 视为瞬时错误，按带抖动的指数退避重试
+    """
+    delay = 1.0
+    for attempt in range(1, _DEEPSEEK_MAX_ATTEMPTS + 1):
+        try:
+            response = _deepseek_session.post(url, headers=headers, json=payload, timeout=_DEEPSEEK_TIMEOUT)
+        except (requests.Timeout, requests.ConnectionError) as exc:
+            if attempt == _DEEPSEEK_MAX_ATTEMPTS:
+                raise
+            print(f"⚠️ DeepSeek 请求异常，{delay:.1f}s 后重试: {exc}")
+        else:
+            if response.status_code not in _DEEPSEEK_RETRY_STATUS or attempt == _DEEPSEEK_MAX_ATTEMPTS:
+                return response
+            print(f"⚠️ DeepSeek 返回 {response.status_code}，{delay:.1f}s 后重试")
+        time.sleep(delay + random.uniform(0, delay))
+        delay = min(delay * 2, _DEEPSEEK_MAX_BACKOFF_SEC)
+
+
+def _get_redis_client():
+    """
+    懒加载 Redis 客户端；未配置 REDIS_URL、未安装 redis 包或初始化失败时返回 None，缓存不生效
+    """
+    global _redis_client, _redis_client_loaded
+    if _redis_client_loaded:
+        return _redis_client
+    with _redis_client_lock:
+        if _redis_client_loaded:
+            return _redis_client
+        redis_url = os.getenv(REDIS_URL_ENV, "").strip()
+        if redis_url:
+            try:
+                import redis
+                _redis_client = redis.Redis.from_url(redis_url, socket_timeout=1)
+                logger.info("已启用 DeepSeek 响应 Redis 缓存")
+            except ImportError:
+                logger.warning("已配置 REDIS_URL 但未安装 redis，DeepSeek 响应缓存不生效: pip install redis")
+            except Exception as exc:
+                logger.warning(f"Redis 客户端初始化失败，DeepSeek 响应缓存不生效: {exc}")
+        _redis_client_loaded = True
+    return _redis_client
+
+
+def _get_cached_deepseek_items(cache_key: str) -> Optional[List[Dict]]:
+    client = _get_redis_client()
+    if client is None:
+        return None
+    try:
+        cached = client.get(cache_key)
+    except Exception as exc:
+        logger.warning(f"读取 DeepSeek 响应缓存失败: {exc}")
+        return None
+    return json.loads(cached) if cached else None
+
+
+def _set_cached_deepseek_items(cache_key: str, items: List[Dict]) -> None:
+    client = _get_redis_client()
+    if client is None:
+        return
+    try:
+        client.setex(cache_key, _DEEPSEEK_CACHE_TTL_SECONDS, json.dumps(items, ensure_ascii=False))
+    except Exception as exc:
+        logger.warning(f"写入 DeepSeek 响应缓存失败: {exc}")
+
+
+def _call_deepseek(prompt: str, system_prompt: str = "", use_cache: bool = True) -> List[Dict]:
+    """
+    调用 DeepSeek 返回分类条目；配置 REDIS_URL 时按模型与完整提示词哈希缓存非空结果
+    :param use_cache: 是否读取已缓存结果（全量重分类时跳过读取，仍写入最新结果）
+    """
     base_url = os.getenv('DEEPSEEK_BASE_URL', "https://api.deepseek.com/v1")
     api_key = os.getenv('DEEPSEEK_API_KEY')
     if not api_key:
@@ -110,107 +234,172 @@ def _call_deepseek(prompt: str) -> List[Dict]:
     payload = {
         "model": os.getenv("DEEPSEEK_MODEL", "deepseek-chat"),
         "messages": [
-            {"role": "system", "content": ""},
+            {"role": "system", "content": system_prompt},
             {"role": "user", "content": prompt}
         ],
         "temperature": 0.2,
         "response_format": {"type": "json_object"}
     }
 
+    cache_key = _DEEPSEEK_CACHE_KEY_PREFIX + hashlib.sha1(
+        json.dumps([payload["model"], payload["messages"]], ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+    if use_cache:
+        cached = _get_cached_deepseek_items(cache_key)
+        if cached is not None:
+            return cached
+
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
     }
 
-    response = requests.post(
-        base_url + "/chat/completions",
-        headers=headers,
-        json=payload,
-        timeout=60
-    )
+    response = _post_deepseek(base_url + "/chat/completions", headers, payload)
     if response.status_code == 400 and payload.get("response_format"):
         retry_payload = dict(payload)
         retry_payload.pop("response_format", None)
-        response = requests.post(
-            base_url + "/chat/completions",
-            headers=headers,
-            json=retry_payload,
-            timeout=60
-        )
+        response = _post_deepseek(base_url + "/chat/completions", headers, retry_payload)
     if response.status_code >= 400:
         print(f"❌ DeepSeek 请求失败: {response.status_code} - {response.text}")
         if "Content Exists Risk" in response.text:
             raise DeepSeekContentRiskError(response.text)
     response.raise_for_status()
     content = response.json()["choices"][0]["message"]["content"].strip()
-    print(content)
-    print("============================================================")
+    logger.debug("DeepSeek 分类响应:\n%s", content)
     if content.startswith("```"):
         content = content.strip("`")
     parsed = json.loads(content)
     if isinstance(parsed, dict) and "items" in parsed:
-        return parsed["items"]
-    if isinstance(parsed, list):
-        return parsed
-    return []
+        items = parsed["items"]
+    elif isinstance(parsed, list):
+        items = parsed
+    else:
+        items = []
+    if items:
+        _set_cached_deepseek_items(cache_key, items)
+    return items
 
 
 def _normalize_sector(sector: str) -> str:
-    if sector in SECTOR_DEFINITIONS:
+    if sector in _SECTOR_KEYS:
         return sector
     return "未分类"
 
 
 def _normalize_industry(industry: str, sector: str) -> str:
-    valid_industries = set(SECTOR_INDUSTRY_MAP.get(sector, []))
-    if industry in valid_industries:
+    if industry in _SECTOR_INDUSTRY_SETS.get(sector, ()):
         return industry
     return "未分类"
 
 
-def _classify_stock_items(stock_items: List[Dict]) -> List[Dict]:
-    prompt = _build_sector_prompt(stock_items)
-    try:
-        print(prompt)
-        return _call_deepseek(prompt)
-    except DeepSeekContentRiskError:
-        if len(stock_items) <= 1:
-            item = stock_items[0] if stock_items else {}
-            print(
-                f"⚠️ DeepSeek 内容风控，跳过: "
-                f"{item.get('stock_code', '')} {item.get('stock_name', '')}"
-            )
-            return []
-        mid = len(stock_items) // 2
-        return _classify_stock_items(stock_items[:mid]) + _classify_stock_items(stock_items[mid:])
+def _parse_classification_item(item: Dict) -> Tuple[str, Tuple[str, str, float]]:
+    """
+    解析 DeepSeek 返回的单条分类结果，二级行业可映射时以其所属一级分类为准
+    :return: (stock_code, (sector, industry, confidence))
+    """
+    stock_code = str(item.get("stock_code", "")).strip()
+    raw_industry = str(item.get("industry", "")).strip()
+    sector = INDUSTRY_TO_SECTOR.get(raw_industry) or _normalize_sector(
+        str(item.get("sector", "")).strip()
+    )
+    industry = _normalize_industry(raw_industry, sector)
+    confidence = float(item.get("confidence", 0) or 0)
+    return stock_code, (sector, industry, confidence)
+
+
+# 单只仍触发内容风控的 (stock_code, stock_name)，进程内记住，后续批次直接跳过，不再拆分重试
+_content_risk_items: set = set()
+
+
+def _classify_stock_items(stock_items: List[Dict], use_cache: bool = True) -> List[Dict]:
+    """
+    调用 DeepSeek 分类股票；遇到内容风控时将批次对半拆分重试，单只仍被风控则跳过
+    :param use_cache: 是否读取 DeepSeek 响应缓存
+    """
+    stock_items = [
+        item for item in stock_items
+        if (item.get('stock_code'), item.get('stock_name')) not in _content_risk_items
+    ]
+    if not stock_items:
+        return []
+    results: List[Dict] = []
+    # 后进先出，先处理左半部分，保持与原批次一致的结果顺序
+    pending: List[List[Dict]] = [stock_items]
+    while pending:
+        items = pending.pop()
+        prompt = _build_sector_prompt(items)
+        try:
+            logger.debug("DeepSeek 分类请求:\n%s", prompt)
+            results.extend(_call_deepseek(prompt, system_prompt=_SECTOR_SYSTEM_PROMPT, use_cache=use_cache))
+        except DeepSeekContentRiskError:
+            if len(items) <= 1:
+                item = items[0] if items else {}
+                _content_risk_items.add((item.get('stock_code'), item.get('stock_name')))
+                print(
+                    f"⚠️ DeepSeek 内容风控，跳过: "
+                    f"{item.get('stock_code', '')} {item.get('stock_name', '')}"
+                )
+                continue
+            mid = len(items) // 2
+            pending.append(items[mid:])
+            pending.append(items[:mid])
+    return results
 
 
 def _parse_xlsx_shared_strings(zf: zipfile.ZipFile) -> List[str]:
     if 'xl/sharedStrings.xml' not in zf.namelist():
         return []
-    root = ET.fromstring(zf.read('xl/sharedStrings.xml'))
     shared_strings: List[str] = []
-    for item in root.findall('a:si', _XLSX_NS):
-        parts = [t.text for t in item.findall('.//a:t', _XLSX_NS) if t.text]
-        shared_strings.append("".join(parts).strip())
+    root = None
+    # 流式解析，每个 <si> 处理完即从根节点移除，避免整棵 DOM 常驻内存
+    with zf.open('xl/sharedStrings.xml') as fp:
+        for event, elem in ET.iterparse(fp, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = elem
+                continue
+            if elem.tag == _XLSX_SI_TAG:
+                parts = [t.text for t in elem.iter(_XLSX_T_TAG) if t.text]
+                shared_strings.append("".join(parts).strip())
+                root.clear()
     return shared_strings
 
 
-def _parse_cell_ref_col_index(cell_ref: str) -> int:
-    col_ref = ""
-    for ch in cell_ref:
-        if ch.isalpha():
-            col_ref += ch
-        else:
-            break
-    if not col_ref:
-        return 1
+def _iter_xlsx_sheet_rows(zf: zipfile.ZipFile, target: str) -> Iterator[ET.Element]:
+    """
+    流式读取工作表中的 <row> 元素，调用方处理完当前行后即被清理，内存只保留一行
+    """
+    sheet_data = None
+    with zf.open(target) as fp:
+        for event, elem in ET.iterparse(fp, events=("start", "end")):
+            if event == "start":
+                if elem.tag == _XLSX_SHEET_DATA_TAG:
+                    sheet_data = elem
+                continue
+            if elem.tag == _XLSX_ROW_TAG and sheet_data is not None:
+                yield elem
+                sheet_data.clear()
+
+
+_CELL_REF_COL_RE = re.compile(r'[A-Za-z]+')
+
+
+@lru_cache(maxsize=128)
+def _col_letters_to_index(col_ref: str) -> int:
     index = 0
-    for ch in col_ref:
-        index = index * 26 + ord(ch.upper()) - ord('A') + 1
+    for ch in col_ref.upper():
+        index = index * 26 + ord(ch) - ord('A') + 1
     return index
 
 
+def _parse_cell_ref_col_index(cell_ref: str) -> int:
+    # 每个单元格都会解析列号，而列字母种类很少，按字母前缀缓存换算结果
+    match = _CELL_REF_COL_RE.match(cell_ref)
+    if not match:
+        return 1
+    return _col_letters_to_index(match.group())
+
+
 def _extract_cell_text(cell: ET.Element, shared_strings: List[str]) -> str:
     cell_type = cell.attrib.get('t')
     if cell_type == 'inlineStr':
@@ -264,13 +453,13 @@ def _load_sector_industry_map_from_excel(excel_path: str) -> Dict[str, Tuple[str
                 continue
 
             sector_name = INDUSTRY_TO_SECTOR.get(industry_name, "未分类")
-            sheet_root = ET.fromstring(zf.read(target))
-            rows = sheet_root.findall('a:sheetData/a:row', _XLSX_NS)
-            if not rows:
+            rows = _iter_xlsx_sheet_rows(zf, target)
+            header_row = next(rows, None)
+            if header_row is None:
                 continue
 
             header_map: Dict[str, int] = {}
-            for cell in rows[0].findall('a:c', _XLSX_NS):
+            for cell in header_row.findall('a:c', _XLSX_NS):
                 col_idx = _parse_cell_ref_col_index(cell.attrib.get('r', 'A1'))
                 col_name = _extract_cell_text(cell, shared_strings)
                 if not col_name:
@@ -284,7 +473,7 @@ def _load_sector_industry_map_from_excel(excel_path: str) -> Dict[str, Tuple[str
             if not code_col:
                 continue
 
-            for row in rows[1:]:
+            for row in rows:
                 row_values: Dict[int, str] = {}
                 for cell in row.findall('a:c', _XLSX_NS):
                     col_idx = _parse_cell_ref_col_index(cell.attrib.get('r', 'A1'))
@@ -368,36 +557,73 @@ def clean_sector_industry_by_excel(excel_path: str, full_refresh: bool = True) -
     }
 
 
+def _needs_classification(stock: Dict) -> bool:
+    """
+    判断股票是否缺少有效的一级分类/二级行业，或两者不一致
+    """
+    sector = (stock.get("sector") or "").strip()
+    industry = (stock.get("industry") or "").strip()
+    return (
+        sector not in _SECTOR_KEYS
+        or INDUSTRY_TO_SECTOR.get(industry) != sector
+    )
+
+
+def _build_needs_classification_filter() -> str:
+    """
+    构造服务端预筛条件：分类为空、一级分类无效，或二级行业不属于所填一级分类
+    结果是 _needs_classification 的超集（服务端不做 strip），客户端仍逐行精确判断
+    """
+    def quoted(values) -> str:
+        return ",".join(f'"{value}"' for value in values)
+
+    clauses = [
+        "sector.is.null",
+        "industry.is.null",
+        f"sector.not.in.({quoted(SECTOR_INDUSTRY_MAP)})",
+    ]
+    clauses.extend(
+        f'and(sector.eq."{sector}",industry.not.in.({quoted(industries)}))'
+        for sector, industries in SECTOR_INDUSTRY_MAP.items()
+    )
+    return ",".join(clauses)
+
+
+_NEEDS_CLASSIFICATION_FILTER = _build_needs_classification_filter()
+
+
+def _iter_a_stock_basic_info(full_refresh: bool = False) -> Iterator[Dict]:
+    """
+    逐页迭代A股基础信息，默认仅产出待补齐行业分类的股票
+    分页未指定排序时相邻页可能返回重复行，按股票代码去重，避免同一股票重复送去分类
+    """
+    seen_codes = set()
+    for stock in db.iter_stock_basic_info(
+        market='A',
+        columns='id,stock_code,stock_name,market,exchange,sector,industry',
+        or_filter=None if full_refresh else _NEEDS_CLASSIFICATION_FILTER
+    ):
+        stock_code = stock.get("stock_code")
+        if not stock.get("id") or not stock_code or stock_code in seen_codes:
+            continue
+        seen_codes.add(stock_code)
+        if full_refresh or _needs_classification(stock):
+            yield {
+                "id": stock.get("id"),
+                "stock_code": stock_code,
+                "stock_name": stock.get("stock_name"),
+                "market": stock.get("market"),
+                "exchange": stock.get("exchange"),
+                "sector": stock.get("sector"),
+                "industry": stock.get("industry"),
+            }
+
+
 def _get_a_stock_basic_info(full_refresh: bool = False) -> List[Dict]:
     """
     获取A股基础信息，默认仅返回待补齐行业分类的股票
     """
-    return [
-        {
-            "id": stock.get("id"),
-            "stock_code": stock.get("stock_code"),
-            "stock_name": stock.get("stock_name"),
-            "market": stock.get("market"),
-            "exchange": stock.get("exchange"),
-            "sector": stock.get("sector"),
-            "industry": stock.get("industry"),
-        }
-        for stock in db.get_stock_basic_info_paginated(
-            market='A',
-            columns='id,stock_code,stock_name,market,exchange,sector,industry'
-        )
-        if stock.get("id")
-        and stock.get("stock_code")
-        and (
-            full_refresh
-            or not str(stock.get("sector") or "").strip()
-            or str(stock.get("sector")).strip() not in SECTOR_DEFINITIONS
-            or not str(stock.get("industry") or "").strip()
-            or str(stock.get("industry")).strip() not in INDUSTRY_TO_SECTOR
-            or INDUSTRY_TO_SECTOR.get(str(stock.get("industry")).strip())
-            != str(stock.get("sector") or "").strip()
-        )
-    ]
+    return list(_iter_a_stock_basic_info(full_refresh=full_refresh))
 
 
 def _get_a_stock_basic_info_with_id() -> List[Dict]:
@@ -415,80 +641,105 @@ def _get_a_stock_basic_info_with_id() -> List[Dict]:
     ]
 
 
+def _fetch_index_member_codes(index_code: str) -> Tuple[str, List[str]]:
+    try:
+        members = [
+            code for stock in get_plate_stocks(index_code)
+            if stock.get('market') == 'A' and (code := stock.get("code"))
+        ]
+    except Exception as exc:
+        print(f"❌ 获取指数成分失败: {index_code} - {exc}")
+        members = []
+    return index_code, members
+
+
 def _build_index_membership_map(index_codes: List[str]) -> Dict[str, List[str]]:
     membership_map: Dict[str, List[str]] = {}
-    for index_code in index_codes:
-        try:
-            members = [
-                stock for stock in get_plate_stocks(index_code)
-                if stock.get('market') == 'A'
-            ]
-        except Exception as exc:
-            print(f"❌ 获取指数成分失败: {index_code} - {exc}")
-            continue
-        for stock in members:
-            stock_code = stock.get("code")
-            if not stock_code:
-                continue
+    if not index_codes:
+        return membership_map
+    # 各指数成分请求相互独立，并发获取后按原顺序合并
+    with ThreadPoolExecutor(max_workers=len(index_codes)) as executor:
+        results = list(executor.map(_fetch_index_member_codes, index_codes))
+    for index_code, member_codes in results:
+        for stock_code in member_codes:
             membership_map.setdefault(stock_code, []).append(index_code)
     return membership_map
 
 
 def classify_and_tag_a_stocks(batch_size: int = 50, full_refresh: bool = False) -> Dict:
     """
-    使用 DeepSeek 为A股股票打一级分类/二级行业标签
+    为A股股票打一级分类/二级行业标签：配置了行业 Excel 时先按 Excel 清洗，
+    Excel 未覆盖的股票再交给 DeepSeek 分类
+    :param batch_size: 单批最多股票数，实际还受输出 token 预算限制
     :param full_refresh: 是否全量分类（默认仅分类未补齐或旧分类股票）
     """
     excel_path = os.getenv(SECTOR_INDUSTRY_EXCEL_ENV, "").strip()
     if excel_path:
         try:
             print(f"📘 使用 Excel 清洗行业分类: {excel_path}")
-            return clean_sector_industry_by_excel(excel_path=excel_path, full_refresh=True)
+            excel_result = clean_sector_industry_by_excel(excel_path=excel_path, full_refresh=True)
         except Exception as exc:
             print(f"⚠️ Excel 清洗失败，回退 DeepSeek 分类: {exc}")
+        else:
+            unmatched = excel_result.get("unmatched", 0)
+            if not unmatched or not os.getenv('DEEPSEEK_API_KEY'):
+                return excel_result
+            # Excel 未覆盖的股票已写为“未分类”，增量模式下只会选出这部分残余股票
+            print(f"🤖 Excel 未覆盖 {unmatched} 只股票，交由 DeepSeek 分类")
+            excel_result["deepseek"] = _classify_with_deepseek(batch_size, full_refresh=False)
+            return excel_result
 
-    a_stocks = _get_a_stock_basic_info(full_refresh=full_refresh)
-    if not a_stocks:
-        return {"total": 0, "updated": 0}
+    return _classify_with_deepseek(batch_size, full_refresh)
 
+
+def _classify_with_deepseek(batch_size: int, full_refresh: bool) -> Dict:
+    """
+    使用 DeepSeek 为待分类的A股股票打标签，边读取边分批并发请求
+    """
+    try:
+        concurrency = max(1, int(os.getenv(DEEPSEEK_CONCURRENCY_ENV, _DEFAULT_DEEPSEEK_CONCURRENCY)))
+    except ValueError:
+        concurrency = _DEFAULT_DEEPSEEK_CONCURRENCY
+
+    batch_size = max(1, min(batch_size, _MAX_OUTPUT_TOKENS_PER_BATCH // _EST_OUTPUT_TOKENS_PER_STOCK))
+
+    total = 0
     updated_count = 0
-    for i in range(0, len(a_stocks), batch_size):
-        batch = a_stocks[i:i + batch_size]
-        batch_codes = {s.get("stock_code") for s in batch if s.get("stock_code")}
-        batch_sector_map: Dict[str, Tuple[str, str, float]] = {}
-        stock_items = [
-            {"stock_code": s["stock_code"], "stock_name": s["stock_name"]}
-            for s in batch
-            if s.get("stock_name")
-        ]
-        if not stock_items:
-            continue
-        try:
-            result = _classify_stock_items(stock_items)
-        except Exception as exc:
-            print(f"❌ DeepSeek 行业分类失败: {exc}")
-            continue
+    # 边读取分页边提交批次，首批凑满即开始请求 DeepSeek；各批次互不依赖，按完成顺序逐批落库
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {}
+        stocks_iter = _iter_a_stock_basic_info(full_refresh=full_refresh)
+        while batch := list(islice(stocks_iter, batch_size)):
+            total += len(batch)
+            stock_items = [
+                {"stock_code": s["stock_code"], "stock_name": s["stock_name"]}
+                for s in batch
+                if s.get("stock_name")
+            ]
+            if stock_items:
+                # 全量重分类时不读取缓存，确保拿到模型的最新结果
+                futures[executor.submit(_classify_stock_items, stock_items, not full_refresh)] = batch
+
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                result = future.result()
+            except Exception as exc:
+                print(f"❌ DeepSeek 行业分类失败: {exc}")
+                continue
+
+            batch_codes = {s.get("stock_code") for s in batch if s.get("stock_code")}
+            batch_sector_map: Dict[str, Tuple[str, str, float]] = dict(
+                parsed for parsed in map(_parse_classification_item, result)
+                if parsed[0] in batch_codes
+            )
+
+            # 每个批次分类完成后立即落库，避免全部批次结束后才更新
+            batch_records = _merge_sector_metadata(batch, batch_sector_map)
+            db.upsert_stock_basic_metadata(batch_records)
+            updated_count += len(batch_records)
 
-        for item in result:
-            stock_code = str(item.get("stock_code", "")).strip()
-            raw_sector = str(item.get("sector", "")).strip()
-            raw_industry = str(item.get("industry", "")).strip()
-            mapped_sector = INDUSTRY_TO_SECTOR.get(raw_industry)
-            if mapped_sector:
-                sector = mapped_sector
-            else:
-                sector = _normalize_sector(raw_sector)
-            industry = _normalize_industry(raw_industry, sector)
-            confidence = float(item.get("confidence", 0) or 0)
-            if stock_code in batch_codes:
-                batch_sector_map[stock_code] = (sector, industry, confidence)
-
-        # 每个批次分类完成后立即落库，避免全部批次结束后才更新
-        batch_records = _merge_sector_metadata(batch, batch_sector_map)
-        db.upsert_stock_basic_metadata(batch_records)
-        updated_count += len(batch_records)
-
-    return {"total": len(a_stocks), "updated": updated_count}
+    return {"total": total, "updated": updated_count}
 
 
 def update_index_membership_for_a_stocks() -> Dict:
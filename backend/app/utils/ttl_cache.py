@@ -30,3 +30,23 @@ class TtlMemoryCache:
 
 leader_stock_metrics_cache = TtlMemoryCache()
 LEADER_STOCK_METRICS_TTL_SECONDS = 24 * 60 * 60
+
+# 板块成分股，成分变动频率低
+plate_stocks_cache = TtlMemoryCache()
+PLATE_STOCKS_TTL_SECONDS = 10 * 60
+
+# 站上 MA20 的 A 股代码集合，按自然日分键；市场宽度每日盘中多次计算，TTL 需短于两次计算间隔
+above_ma20_cache = TtlMemoryCache()
+ABOVE_MA20_TTL_SECONDS = 10 * 60
+
+# /api/dates 可用统计日期列表，仅随自然日与开盘时间变化
+available_dates_cache = TtlMemoryCache()
+AVAILABLE_DATES_TTL_SECONDS = 10 * 60
+
+# /api/market_breadth 查询结果，宽度数据每日盘中仅计算数次
+market_breadth_cache = TtlMemoryCache()
+MARKET_BREADTH_TTL_SECONDS = 60
+
+# 行业成分股的单只股票快照，按富途代码分键；不同行业/重复请求共享，仅对过期代码重新请求富途
+stock_quote_cache = TtlMemoryCache()
+STOCK_QUOTE_TTL_SECONDS = 60
@@ -16,3 +16,14 @@ $$;
 -- 添加函数说明
 COMMENT ON FUNCTION get_distinct_dates IS '获取 stock_records 表中不重复的日期列表，按日期倒序排列';
 
+-- 函数：统计不重复的日期数量（只返回一个数字，避免为计数拉取日期列表）
+CREATE OR REPLACE FUNCTION count_distinct_dates()
+RETURNS BIGINT
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT COUNT(DISTINCT stock_records.date)
+  FROM stock_records;
+$$;
+
+COMMENT ON FUNCTION count_distinct_dates IS '统计 stock_records 表中不重复的日期数量';
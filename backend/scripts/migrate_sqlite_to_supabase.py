@@ -14,8 +14,11 @@ SQLite 到 Supabase 数据迁移脚本
 import sqlite3
 import os
 import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 
+import pandas as pd
+
 # 添加父目录到路径以便导入 app 模块
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -25,8 +28,29 @@ from dotenv import load_dotenv
 # 加载环境变量
 load_dotenv()
 
+# 迁移时缺失值补 0.0 的数值列
+NUMERIC_COLUMNS = ['change_ratio', 'volume', 'amount', 'pe_ratio', 'volume_ratio', 'turnover_rate']
+
+# 并发 upsert 的线程数，以及同时在途（已读取未写入）的最大批次数
+UPSERT_WORKERS = 8
+MAX_IN_FLIGHT_BATCHES = UPSERT_WORKERS * 2
 
-def migrate_data(sqlite_db_path: str = 'stock_data.db', batch_size: int = 100):
+
+def _upsert_batch(batch_records: list) -> int:
+    """
+    写入一批记录到 Supabase
+
+    :param batch_records: 记录列表
+    :return: 写入的记录数
+    """
+    supabase_db.client.table('stock_records').upsert(
+        batch_records,
+        on_conflict='date,data_source,market,data_type,stock_code'
+    ).execute()
+    return len(batch_records)
+
+
+def migrate_data(sqlite_db_path: str = 'stock_data.db', batch_size: int = 500):
     """
     从 SQLite 迁移数据到 Supabase
 
@@ -63,71 +87,50 @@ def migrate_data(sqlite_db_path: str = 'stock_data.db', batch_size: int = 100):
             print("❌ 迁移已取消")
             return
 
+        # 仅对本连接生效：加大页缓存，排序临时数据放在内存中；源库只读，不建索引
+        cursor.execute('PRAGMA cache_size=-200000')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+
         # 分批读取并迁移数据
         print(f"\n🔄 开始迁移数据（批次大小: {batch_size}）...")
-        cursor.execute('''
-                       SELECT date, time, data_source, market, data_type, rank_order, stock_code, stock_name, change_ratio, volume, amount, pe_ratio, volume_ratio, turnover_rate
-                       FROM stock_records
-                       ORDER BY date DESC, id
-                       ''')
+        query = '''
+                SELECT date, time, data_source, market, data_type, rank_order, stock_code, stock_name, change_ratio, volume, amount, pe_ratio, volume_ratio, turnover_rate
+                FROM stock_records
+                ORDER BY date DESC, id
+                '''
 
         migrated_count = 0
         error_count = 0
-        batch_records = []
-
-        for row in cursor:
-            # 解析 SQLite 记录
-            date, time, data_source, market, data_type, rank_order, \
-                stock_code, stock_name, change_ratio, volume, amount, \
-                pe_ratio, volume_ratio, turnover_rate = row
-
-            # 准备 Supabase 记录
-            record = {
-                'date': date,
-                'time': time,
-                'data_source': data_source,
-                'market': market,
-                'data_type': data_type,
-                'rank_order': rank_order,
-                'stock_code': stock_code,
-                'stock_name': stock_name,
-                'change_ratio': float(change_ratio) if change_ratio is not None else 0.0,
-                'volume': float(volume) if volume is not None else 0.0,
-                'amount': float(amount) if amount is not None else 0.0,
-                'pe_ratio': float(pe_ratio) if pe_ratio is not None else 0.0,
-                'volume_ratio': float(volume_ratio) if volume_ratio is not None else 0.0,
-                'turnover_rate': float(turnover_rate) if turnover_rate is not None else 0.0
-            }
-
-            batch_records.append(record)
-
-            # 批量插入
-            if len(batch_records) >= batch_size:
+        pending = {}
+
+        def collect(done):
+            """汇总已完成批次的结果"""
+            nonlocal migrated_count, error_count
+            for future in done:
+                batch_len = pending.pop(future)
                 try:
-                    supabase_db.client.table('stock_records').upsert(
-                        batch_records,
-                        on_conflict='date,data_source,market,data_type,stock_code'
-                    ).execute()
-                    migrated_count += len(batch_records)
+                    migrated_count += future.result()
                     print(f"✅ 已迁移: {migrated_count}/{total_count} ({migrated_count * 100 / total_count:.1f}%)")
                 except Exception as e:
                     print(f"❌ 批次插入失败: {e}")
-                    error_count += len(batch_records)
-
-                batch_records = []
-
-        # 插入剩余记录
-        if batch_records:
-            try:
-                supabase_db.client.table('stock_records').upsert(
-                    batch_records,
-                    on_conflict='date,data_source,market,data_type,stock_code'
-                ).execute()
-                migrated_count += len(batch_records)
-                print(f"✅ 已迁移: {migrated_count}/{total_count} ({migrated_count * 100 / total_count:.1f}%)")
-            except Exception as e:
-                print(f"❌ 最后批次插入失败: {e}")
-                error_count += len(batch_records)
+                    error_count += batch_len
+
+        # 按批次读取为 DataFrame，按列转换类型，避免逐行构造字典；各批次并发写入
+        with ThreadPoolExecutor(max_workers=UPSERT_WORKERS) as executor:
+            for chunk in pd.read_sql_query(query, conn, chunksize=batch_size):
+                # 含空值的整数列会被推断为 float，先还原为可空整数，再将缺失值统一转为 None
+                chunk['rank_order'] = chunk['rank_order'].astype('Int64')
+                chunk = chunk.astype(object).where(chunk.notnull(), None)
+                chunk[NUMERIC_COLUMNS] = chunk[NUMERIC_COLUMNS].astype(float).fillna(0.0)
+                batch_records = chunk.to_dict('records')
+
+                # 限制在途批次数，避免读取速度远超写入时占用过多内存
+                if len(pending) >= MAX_IN_FLIGHT_BATCHES:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending[executor.submit(_upsert_batch, batch_records)] = len(batch_records)
+
+            collect(wait(pending).done)
 
         # 关闭 SQLite 连接
         conn.close()
@@ -176,11 +179,10 @@ def verify_migration(sqlite_db_path: str = 'stock_data.db'):
         conn.close()
 
         # Supabase 统计
-        dates = supabase_db.get_available_dates(limit=1000)
-        supabase_dates_count = len(dates)
+        supabase_dates_count = supabase_db.get_distinct_date_count()
 
-        # 获取总记录数（需要实现一个简单的计数方法）
-        response = supabase_db.client.table('stock_records').select('id', count='exact').limit(1).execute()
+        # 获取总记录数（head=True 只返回计数，不传输记录）
+        response = supabase_db.client.table('stock_records').select('id', count='exact', head=True).execute()
         supabase_count = response.count if hasattr(response, 'count') else 0
 
         print(f"\n📊 SQLite:")
@@ -217,7 +219,7 @@ if __name__ == '__main__':
         sqlite_path = input("请输入 SQLite 数据库文件路径: ").strip()
 
     # 执行迁移
-    migrate_data(sqlite_path, batch_size=100)
+    migrate_data(sqlite_path, batch_size=500)
 
     # 验证迁移
     verify_input = input("\n是否验证迁移结果？(yes/no): ")